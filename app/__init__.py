@@ -8,7 +8,8 @@ import logging # --- ADDED ---
 
 from .config import Config
 from .logger import setup_logging
-from .extensions import jwt, genai
+from .fastjson import FastJSONProvider
+from .extensions import jwt, async_clients, response_cache, scheduler, job_store, job_runner, question_index, question_bank, content_retriever, metrics, response_compressor
 from .routes import main_bp
 from .services import ServiceError
 
@@ -17,6 +18,7 @@ def create_app():
     
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = FastJSONProvider(app)
 
     CORS(app, resources={
         r"/*": {
@@ -30,13 +32,17 @@ def create_app():
     setup_logging(app)
     
     jwt.init_app(app)
-
-    try:
-        genai.configure(api_key=app.config['GOOGLE_API_KEY'])
-        app.logger.info("Gemini API configured successfully.")
-    except Exception as e:
-        app.logger.critical(f"Error configuring Gemini API: {e}", exc_info=True)
-        exit(f"Could not configure Gemini API: {e}")
+    response_cache.init_app(app)
+    scheduler.init_app(app)
+    job_store.init_app(app)
+    job_runner.init_app(app)
+    question_index.init_app(app)
+    question_bank.init_app(app)
+    content_retriever.init_app(app)
+    metrics.init_app(app)
+    response_compressor.init_app(app)
+    # Provider SDKs are imported on first use (or warmed up in the background).
+    async_clients.init_app(app)
 
     app.register_blueprint(main_bp)
 
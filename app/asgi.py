@@ -0,0 +1,187 @@
+import io
+import sys
+import asyncio
+import logging
+from contextlib import aclosing
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response
+from flask_jwt_extended import verify_jwt_in_request
+
+from .extensions import async_clients
+from .routes import (
+    STREAM_HEADERS, buffered_bulk_response, buffered_generation_response, load_bulk_generation_request,
+    load_generation_request, requested_stream_format, stream_generation_async, stream_mimetype
+)
+from .services import stream_bulk_questions
+
+
+error_logger = logging.getLogger('error')
+
+
+class _AsyncStream:
+    """Marks a view result whose body is produced by an async generator of str chunks."""
+    def __init__(self, chunks, mimetype):
+        self.chunks = chunks
+        self.mimetype = mimetype
+
+
+async def generate_questions_native():
+    verify_jwt_in_request()
+    validated_data = load_generation_request()
+
+    stream_format = requested_stream_format()
+    if stream_format:
+        return _AsyncStream(stream_generation_async(validated_data, stream_format), stream_mimetype(stream_format))
+
+    return await buffered_generation_response(validated_data)
+
+
+async def generate_bulk_questions_native():
+    verify_jwt_in_request()
+    papers = load_bulk_generation_request()
+
+    stream_format = requested_stream_format()
+    if stream_format:
+        return _AsyncStream(
+            stream_generation_async(papers, stream_format, stream_bulk_questions), stream_mimetype(stream_format)
+        )
+
+    return await buffered_bulk_response(papers)
+
+
+# Routes served directly on the ASGI event loop; everything else goes through Flask.
+NATIVE_ROUTES = {
+    ("POST", "/generate_questions"): generate_questions_native,
+    ("POST", "/generate_questions/bulk"): generate_bulk_questions_native,
+}
+
+
+def _build_environ(scope, body):
+    """Minimal WSGI environ for an ASGI HTTP scope, used to build a Flask request context."""
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+        "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class NativeASGIApp:
+    """
+    Serves the generation endpoints directly on the server's event loop, so
+    that many slow LLM calls share one loop instead of each holding a WSGI
+    thread. Requests still run inside a Flask request context, so JWT checks,
+    schemas, before/after-request hooks (access log, CORS) and the registered
+    error handlers behave exactly as in the Flask app. All other routes are
+    delegated to the Flask app through WsgiToAsgi.
+    """
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        view = NATIVE_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if view is None:
+            await self.wsgi_app(scope, receive, send)
+            return
+
+        await self._dispatch(view, scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_clients.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _dispatch(self, view, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.extend(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+
+        app = self.flask_app
+        with app.request_context(_build_environ(scope, bytes(body))):
+            stream = None
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view()
+                if isinstance(rv, _AsyncStream):
+                    stream = rv
+                    rv = Response(mimetype=stream.mimetype, headers=STREAM_HEADERS)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+
+            response = app.process_response(app.make_response(rv))
+
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in response.headers.items()
+                ],
+            })
+
+            if stream is None:
+                await send({"type": "http.response.body", "body": response.get_data()})
+                return
+
+            await self._send_stream(stream, receive, send)
+
+    async def _send_stream(self, stream, receive, send):
+        """Sends the stream chunk by chunk, stopping generation if the client goes away."""
+        async def pump():
+            async with aclosing(stream.chunks) as chunks:
+                async for chunk in chunks:
+                    await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pump_task = asyncio.ensure_future(pump())
+        watch_task = asyncio.ensure_future(watch_disconnect())
+        try:
+            await asyncio.wait({pump_task, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            pump_task.cancel()
+            watch_task.cancel()
+        if pump_task.done() and not pump_task.cancelled() and pump_task.exception():
+            error_logger.error(f"Streaming response failed: {pump_task.exception()}")
+
+
+def create_asgi_app(flask_app):
+    return NativeASGIApp(flask_app)
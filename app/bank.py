@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+
+error_logger = logging.getLogger('error')
+
+# Rule attributes a banked question is filed under, as (column, rule key).
+BANK_SCOPE = (
+    ("module", "module"),
+    ("unit", "unit"),
+    ("question_type", "questionType"),
+    ("difficulty_level", "difficultyLevel"),
+    ("cognitive_level", "cognitiveLevel"),
+    ("mark", "mark"),
+    ("course_outcome", "courseOutcome"),
+)
+_SCOPE_COLUMNS = ", ".join(column for column, _ in BANK_SCOPE)
+_SCOPE_WHERE = " AND ".join(f"{column} = ?" for column, _ in BANK_SCOPE)
+
+
+def bank_scope(data, rule):
+    """The values a rule's questions are banked and looked up under."""
+    merged = {"module": data["module"], "unit": data.get("unit", ""), **rule}
+    return tuple(merged.get(key, "") for _, key in BANK_SCOPE)
+
+
+def _fingerprint(question):
+    text = " ".join(question.get("question", "").lower().split())
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class QuestionBank:
+    """
+    SQLite store of every validated question the service has generated,
+    indexed on the rule attributes it was generated for. Rules can be filled
+    from the bank before any upstream call is made. Each hand-out is recorded
+    per requester, so the same user is not served the same question twice.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.max_age = 0
+        self.repeat_after = 0
+        self.served = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("QUESTION_BANK_ENABLED", True)
+        self.path = app.config.get("QUESTION_BANK_PATH", "cache/question_bank.sqlite3")
+        self.max_age = app.config.get("QUESTION_BANK_MAX_AGE_SECONDS", 7776000)
+        self.repeat_after = app.config.get("QUESTION_BANK_REPEAT_AFTER_SECONDS", 604800)
+        if not self.enabled:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bank_questions ("
+                " id INTEGER PRIMARY KEY,"
+                " module TEXT NOT NULL,"
+                " unit TEXT NOT NULL,"
+                " question_type TEXT NOT NULL,"
+                " difficulty_level TEXT NOT NULL,"
+                " cognitive_level TEXT NOT NULL,"
+                " mark INTEGER NOT NULL,"
+                " course_outcome TEXT NOT NULL,"
+                " fingerprint TEXT NOT NULL,"
+                " question TEXT NOT NULL,"
+                " served_count INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                f" UNIQUE ({_SCOPE_COLUMNS}, fingerprint))"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS bank_questions_scope ON bank_questions ({_SCOPE_COLUMNS}, created_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bank_served ("
+                " question_id INTEGER NOT NULL,"
+                " owner TEXT NOT NULL,"
+                " served_at REAL NOT NULL,"
+                " PRIMARY KEY (owner, question_id))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _mark_served(self, conn, question_ids, owner, now):
+        conn.executemany(
+            "INSERT OR REPLACE INTO bank_served (question_id, owner, served_at) VALUES (?, ?, ?)",
+            [(question_id, owner, now) for question_id in question_ids]
+        )
+
+    def take(self, scope, limit, owner, max_age=None):
+        """
+        Up to `limit` banked questions for `scope` that are newer than `max_age`
+        seconds (default QUESTION_BANK_MAX_AGE_SECONDS) and that `owner` has not
+        been served (within QUESTION_BANK_REPEAT_AFTER_SECONDS, when set).
+        Least-served questions come first. The returned questions are recorded
+        as served to `owner`.
+        """
+        if not self.enabled or limit <= 0:
+            return []
+        now = time.time()
+        max_age = self.max_age if max_age is None else max_age
+        served_since = now - self.repeat_after if self.repeat_after else 0
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    f"SELECT id, question FROM bank_questions WHERE {_SCOPE_WHERE}"
+                    " AND created_at >= ?"
+                    " AND id NOT IN (SELECT question_id FROM bank_served WHERE owner = ? AND served_at >= ?)"
+                    " ORDER BY served_count, created_at DESC LIMIT ?",
+                    (*scope, now - max_age if max_age else 0, owner, served_since, limit)
+                ).fetchall()
+                if rows:
+                    ids = [row_id for row_id, _ in rows]
+                    conn.execute(
+                        f"UPDATE bank_questions SET served_count = served_count + 1 "
+                        f"WHERE id IN ({', '.join('?' * len(ids))})", ids
+                    )
+                    self._mark_served(conn, ids, owner, now)
+        except sqlite3.Error as e:
+            error_logger.warning(f"Question bank read failed: {e}")
+            return []
+        with self._lock:
+            self.served += len(rows)
+        return [json.loads(question) for _, question in rows]
+
+    def save(self, scope, questions, owner):
+        """Banks freshly generated questions and records them as served to `owner`."""
+        if not self.enabled or not questions:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                ids = []
+                for q in questions:
+                    fingerprint = _fingerprint(q)
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO bank_questions ({_SCOPE_COLUMNS}, fingerprint, question,"
+                        " served_count, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                        (*scope, fingerprint, json.dumps(q), now)
+                    )
+                    ids.extend(row_id for (row_id,) in conn.execute(
+                        f"SELECT id FROM bank_questions WHERE {_SCOPE_WHERE} AND fingerprint = ?",
+                        (*scope, fingerprint)
+                    ))
+                self._mark_served(conn, ids, owner, now)
+        except sqlite3.Error as e:
+            error_logger.warning(f"Question bank write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"served": self.served}
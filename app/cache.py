@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+error_logger = logging.getLogger('error')
+
+
+def make_cache_key(prompt_text, provider_name, model_name, variant=0):
+    """
+    Content-addressed key for one LLM generation. `variant` separates
+    repeated identical prompts within the same request.
+    """
+    digest = hashlib.sha256()
+    for part in (provider_name, model_name, str(variant), prompt_text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry TTL."""
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        hits = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                hits[key] = value
+        return hits
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk LRU cache with per-entry TTL, shared by every worker process
+    that points at the same database file.
+    """
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_last_access "
+                "ON llm_cache (last_access)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Looks several keys up over one connection; returns the hits by key."""
+        now = time.time()
+        hits = {}
+        with self._connect() as conn:
+            for key in keys:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                value, expires_at = row
+                if expires_at <= now:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    continue
+                conn.execute(
+                    "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)
+                )
+                hits[key] = json.loads(value)
+        return hits
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now)
+            )
+            conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+class ResponseCache:
+    """
+    Caches validated per-rule LLM generations so that identical prompts
+    skip the upstream call. Backend is chosen from the app config.
+    """
+    def __init__(self):
+        self.backend = None
+        self.ttl = 0
+
+    def init_app(self, app):
+        backend_name = app.config.get("CACHE_BACKEND", "memory")
+        self.ttl = app.config.get("CACHE_TTL_SECONDS", 86400)
+        max_entries = app.config.get("CACHE_MAX_ENTRIES", 1024)
+
+        if backend_name == "memory":
+            self.backend = MemoryCacheBackend(max_entries=max_entries)
+        elif backend_name == "sqlite":
+            self.backend = SQLiteCacheBackend(
+                app.config.get("CACHE_SQLITE_PATH", "cache/llm_cache.sqlite3"),
+                max_entries=max_entries
+            )
+        elif backend_name == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {backend_name}")
+
+    @property
+    def enabled(self):
+        return self.backend is not None and self.ttl > 0
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Looks several keys up at once; returns the hits by key. Backends may
+        block (SQLite), so callers on an event loop run this in a thread.
+        """
+        if not self.enabled or not keys:
+            return {}
+        try:
+            return self.backend.get_many(keys)
+        except Exception as e:
+            error_logger.warning(f"Response cache read failed: {e}")
+            return {}
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            error_logger.warning(f"Response cache write failed: {e}")
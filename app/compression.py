@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+
+from flask import request
+from werkzeug.http import remove_entity_headers
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+
+_COMPRESSIBLE_MIMETYPES = ("application/json", "text/plain", "text/html")
+
+
+def _compressible(response):
+    return (
+        not response.is_streamed
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and (response.mimetype in _COMPRESSIBLE_MIMETYPES or response.mimetype.endswith("+json"))
+    )
+
+
+class ResponseCompressor:
+    """
+    Content-hash ETags and negotiated compression for buffered responses,
+    applied in an after-request hook so that the Flask routes and the native
+    ASGI generation endpoints are treated alike. Generated question sets and
+    job results are large, LaTeX-heavy JSON: a client polling a result it
+    already holds gets a 304 for `If-None-Match`, and everything else over
+    COMPRESSION_MIN_BYTES is sent brotli- (when installed) or gzip-encoded.
+    Streamed responses are left untouched.
+    """
+    def __init__(self):
+        self.compression = True
+        self.etags = True
+        self.min_bytes = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 5
+        self.encodings = ("gzip",)
+
+    def init_app(self, app):
+        self.compression = app.config.get("RESPONSE_COMPRESSION", True)
+        self.etags = app.config.get("RESPONSE_ETAGS", True)
+        self.min_bytes = app.config.get("COMPRESSION_MIN_BYTES", 1024)
+        self.gzip_level = app.config.get("COMPRESSION_GZIP_LEVEL", 6)
+        self.brotli_quality = app.config.get("COMPRESSION_BROTLI_QUALITY", 5)
+        # Listed in order of preference when the client accepts both equally.
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+        if self.compression or self.etags:
+            app.after_request(self.process_response)
+
+    def process_response(self, response):
+        if response.status_code != 200 or not _compressible(response):
+            return response
+        data = response.get_data()
+        if self.compression:
+            response.vary.add("Accept-Encoding")
+
+        if self.etags:
+            # Weak, since the same content is served under several encodings.
+            etag = hashlib.sha256(data).hexdigest()[:32]
+            response.set_etag(etag, weak=True)
+            # Only reads can be answered with a 304 (RFC 9110); by the time a
+            # POST's result is known its work is done, so the header is ignored.
+            if request.method in ("GET", "HEAD") and request.if_none_match.contains_weak(etag):
+                response.status_code = 304
+                response.set_data(b"")
+                remove_entity_headers(response.headers)
+                return response
+
+        if not self.compression or len(data) < self.min_bytes:
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        if encoding == "br":
+            response.set_data(brotli.compress(data, quality=self.brotli_quality))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=self.gzip_level, mtime=0))
+        response.headers["Content-Encoding"] = encoding
+        return response
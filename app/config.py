@@ -37,6 +37,13 @@ class Config:
     DEEPSEEK_MODEL_NAME = os.getenv("DEEPSEEK_MODEL_NAME", "deepseek-chat")
     OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-4-turbo")
 
+    # API endpoints of the OpenAI-compatible providers (override for proxies or local mocks)
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+    DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+
+    # Serving Mode: "asgi" (native event loop for generation endpoints) or "wsgi"
+    SERVER_MODE = os.getenv("SERVER_MODE", "asgi").lower()
+
     # CORS Configuration
     CORS_ORIGINS = os.getenv("CORS_ORIGINS")
 
@@ -45,7 +52,133 @@ class Config:
     LOG_LEVEL_ERROR = os.getenv("LOG_LEVEL_ERROR", "ERROR").upper()
     LOG_LEVEL_ACCESS = os.getenv("LOG_LEVEL_ACCESS", "INFO").upper()
     LOG_LEVEL_SECURITY = os.getenv("LOG_LEVEL_SECURITY", "INFO").upper()
+    # "text" or "json" (one object per line with request_id and extra fields)
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+    # Fraction of INFO access-log lines kept; warnings and errors are always kept.
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0"))
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+    # Response Cache Configuration
+    # CACHE_BACKEND is one of "memory", "sqlite" or "none". Use "sqlite" to
+    # share cached generations between uvicorn workers.
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+    CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache/llm_cache.sqlite3")
+
+    # Buffered responses: content-hash ETags (a matching GET gets a 304) and
+    # gzip/brotli compression, negotiated, for bodies of COMPRESSION_MIN_BYTES or more.
+    RESPONSE_ETAGS = get_bool_env("RESPONSE_ETAGS", True)
+    RESPONSE_COMPRESSION = get_bool_env("RESPONSE_COMPRESSION", True)
+    COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+    # Upstream HTTP Connection Pools (per worker, per event loop)
+    LLM_HTTP2 = get_bool_env("LLM_HTTP2", True)
+    LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+    LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+    LLM_POOL_KEEPALIVE_SECONDS = float(os.getenv("LLM_POOL_KEEPALIVE_SECONDS", "60"))
+    LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "10"))
+    LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "170"))
+
+    # Provider SDKs are imported on first use. Providers listed here, e.g.
+    # "gemini,openai", are imported in the background at startup instead.
+    LLM_WARMUP_PROVIDERS = [p.strip().lower() for p in os.getenv("LLM_WARMUP_PROVIDERS", "").split(",") if p.strip()]
+
+    # Multi-rule packing: small rules of one request share a single upstream
+    # call, bounded by total questions and estimated tokens (prompt + answers).
+    RULE_PACKING = get_bool_env("RULE_PACKING", True)
+    RULE_PACKING_MAX_QUESTIONS = int(os.getenv("RULE_PACKING_MAX_QUESTIONS", "10"))
+    RULE_PACKING_MAX_TOKENS = int(os.getenv("RULE_PACKING_MAX_TOKENS", "8000"))
+
+    # Near-duplicate filtering of generated questions, persisted per content
+    DEDUP_ENABLED = get_bool_env("DEDUP_ENABLED", True)
+    DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "cache/question_index.sqlite3")
+    DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.85"))
+    DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+    DEDUP_INDEX_CACHE_SIZE = int(os.getenv("DEDUP_INDEX_CACHE_SIZE", "64"))
+
+    # Question bank of every generated question, indexed on the rule attributes
+    QUESTION_BANK_ENABLED = get_bool_env("QUESTION_BANK_ENABLED", True)
+    QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", "cache/question_bank.sqlite3")
+    QUESTION_BANK_MAX_AGE_SECONDS = int(os.getenv("QUESTION_BANK_MAX_AGE_SECONDS", "7776000"))
+    QUESTION_BANK_REPEAT_AFTER_SECONDS = int(os.getenv("QUESTION_BANK_REPEAT_AFTER_SECONDS", "604800"))
+
+    # Most papers accepted by one /generate_questions/bulk request
+    BULK_MAX_PAPERS = int(os.getenv("BULK_MAX_PAPERS", "50"))
+
+    # Content over CONTENT_MAX_PROMPT_TOKENS (estimated) is chunked and indexed, and
+    # each rule's prompt only carries the chunks most relevant to it, up to that budget
+    CONTENT_RETRIEVAL = get_bool_env("CONTENT_RETRIEVAL", True)
+    CONTENT_MAX_PROMPT_TOKENS = int(os.getenv("CONTENT_MAX_PROMPT_TOKENS", "6000"))
+    CONTENT_CHUNK_TOKENS = int(os.getenv("CONTENT_CHUNK_TOKENS", "400"))
+    CONTENT_INDEX_CACHE_SIZE = int(os.getenv("CONTENT_INDEX_CACHE_SIZE", "16"))
+
+    # Prometheus metrics on /metrics. Workers share snapshots through METRICS_DIR
+    # (empty = report only the worker that serves the scrape).
+    METRICS_ENABLED = get_bool_env("METRICS_ENABLED", True)
+    METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+    # Gemini context caching of the shared prompt prefix. Prefixes smaller than
+    # GEMINI_CONTEXT_CACHE_MIN_TOKENS (estimated) are sent inline; 0 disables.
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "600"))
+
+    # Upstream Scheduling Limits (0 disables a limit). Concurrency is capped per
+    # worker process; the per-minute budgets are shared by all workers through
+    # SCHEDULER_BUDGET_PATH.
+    SCHEDULER_BUDGET_PATH = os.getenv("SCHEDULER_BUDGET_PATH", "cache/provider_budgets.sqlite3")
+    GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "0"))
+    GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "0"))
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+    OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0"))
+    DEEPSEEK_MAX_CONCURRENCY = int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", "8"))
+    DEEPSEEK_REQUESTS_PER_MINUTE = int(os.getenv("DEEPSEEK_REQUESTS_PER_MINUTE", "0"))
+    DEEPSEEK_TOKENS_PER_MINUTE = int(os.getenv("DEEPSEEK_TOKENS_PER_MINUTE", "0"))
+    # Expected completion size, added to the prompt estimate for token budgeting.
+    ESTIMATED_TOKENS_PER_QUESTION = int(os.getenv("ESTIMATED_TOKENS_PER_QUESTION", "300"))
+
+    # Rules asking for more questions than this are split into parallel batches (0 disables).
+    RULE_BATCH_SIZE = int(os.getenv("RULE_BATCH_SIZE", "10"))
+
+    # Generation Deadlines
+    # Overall budget for one generation request; rules still running when it
+    # ends are cancelled and reported as timed out.
+    REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "180"))
+    # Optional tighter cap for each rule (0 uses the request budget).
+    RULE_TIMEOUT_SECONDS = float(os.getenv("RULE_TIMEOUT_SECONDS", "0"))
+
+    # Follow-up requests for questions missing from a short or partially invalid answer.
+    LLM_SHORTFALL_RETRIES = int(os.getenv("LLM_SHORTFALL_RETRIES", "1"))
+    LLM_RETRY_JITTER_SECONDS = float(os.getenv("LLM_RETRY_JITTER_SECONDS", "0.5"))
+
+    # Streamed upstream calls: questions are parsed and validated as they arrive,
+    # and those already finished are kept if the call breaks off or runs out of time.
+    LLM_STREAMING = get_bool_env("LLM_STREAMING", True)
+    LLM_STREAM_DEADLINE_MARGIN_SECONDS = float(os.getenv("LLM_STREAM_DEADLINE_MARGIN_SECONDS", "2"))
+
+    # Provider Routing Policy
+    # Comma-separated providers to fail over to when the requested one errors,
+    # e.g. "openai,deepseek". Empty disables failover and hedging by default.
+    PROVIDER_FALLBACK_ORDER = [p.strip().lower() for p in os.getenv("PROVIDER_FALLBACK_ORDER", "").split(",") if p.strip()]
+    # Start a hedged call on the next provider once a call is slower than this
+    # latency percentile of the provider's recent calls (0 disables hedging).
+    HEDGE_LATENCY_PERCENTILE = float(os.getenv("HEDGE_LATENCY_PERCENTILE", "95"))
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # Hedge delay used until HEDGE_MIN_SAMPLES latencies have been observed.
+    HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "60"))
 
+    # Asynchronous Generation Jobs
+    JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs/jobs.sqlite3")
+    JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+    # Unfinished jobs whose worker has not checked in for this long are reported as failed.
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+    JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))
 
     # Critical variable check
     if not all([JWT_SECRET_KEY, ADMIN_USERNAME, ADMIN_PASSWORD, GOOGLE_API_KEY, DEEPSEEK_API_KEY, OPENAI_API_KEY]):
@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+error_logger = logging.getLogger('error')
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_SHINGLE_SIZE = 2
+_BAND_ROWS = 4
+_BAND_SEED = np.uint64(0x9E3779B97F4A7C15)
+_BAND_MULTIPLIER = np.uint64(1000003)
+_UNSORTED_TAIL = 1024
+# Numbers and operator symbols are tokens of their own, so that questions
+# differing only in their numbers do not look alike; other punctuation is dropped.
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|[^\W\d_]+|[-+*/^=<>|()\[\]{}\u00d7\u00f7\u2212-\u22ff]", re.UNICODE)
+
+
+def content_key(content):
+    """Key of the per-content index that a generation's questions are checked against."""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class MinHasher:
+    """
+    MinHash signatures over token bigrams of normalised question text, where
+    words, numbers and operator symbols are separate tokens.
+    The fraction of equal signature slots estimates the Jaccard similarity of
+    two questions' shingle sets.
+    """
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        tokens = _TOKEN.findall(text.lower())
+        if len(tokens) <= _SHINGLE_SIZE:
+            shingles = {" ".join(tokens)}
+        else:
+            shingles = {
+                " ".join(tokens[i:i + _SHINGLE_SIZE]) for i in range(len(tokens) - _SHINGLE_SIZE + 1)
+            }
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        # Universal hashing (a*x + b mod p) as the permutations; the uint64
+        # products may wrap, which is harmless for hashing.
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class _ContentIndex:
+    """
+    Signatures stored for one content key, plus a banded LSH index over them:
+    each signature is cut into bands of _BAND_ROWS slots, and a lookup only
+    compares against signatures that share at least one whole band. Band keys
+    are kept in a sorted array (searched with `searchsorted`) and a short
+    unsorted tail of recent additions that is merged in periodically.
+    """
+    def __init__(self, num_perm):
+        self.bands = max(1, num_perm // _BAND_ROWS)
+        self.signatures = np.empty((64, num_perm), dtype=np.uint32)
+        self.band_keys = np.empty((64, self.bands), dtype=np.uint64)
+        self.size = 0
+        self.last_row = 0
+        # Serialises catching up with the database and admitting into this index.
+        self.lock = threading.Lock()
+        self._indexed = 0
+        self._sorted_keys = np.empty(0, dtype=np.uint64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+
+    def _band_keys(self, signature):
+        bands = signature[:self.bands * _BAND_ROWS].reshape(self.bands, _BAND_ROWS).astype(np.uint64)
+        keys = np.arange(self.bands, dtype=np.uint64) * _BAND_SEED
+        for column in bands.T:
+            keys = keys * _BAND_MULTIPLIER + column
+        return keys
+
+    def append(self, signature):
+        if self.size == len(self.signatures):
+            capacity = len(self.signatures) * 2
+            self.signatures = np.resize(self.signatures, (capacity, self.signatures.shape[1]))
+            self.band_keys = np.resize(self.band_keys, (capacity, self.bands))
+        self.signatures[self.size] = signature
+        self.band_keys[self.size] = self._band_keys(signature)
+        self.size += 1
+        if self.size - self._indexed >= _UNSORTED_TAIL:
+            self._merge_tail()
+
+    def _merge_tail(self):
+        keys = self.band_keys[:self.size].ravel()
+        order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[order]
+        self._sorted_rows = order // self.bands
+        self._indexed = self.size
+
+    def max_similarity(self, signature):
+        if not self.size:
+            return 0.0
+        keys = self._band_keys(signature)
+        lo = np.searchsorted(self._sorted_keys, keys, side='left')
+        hi = np.searchsorted(self._sorted_keys, keys, side='right')
+        candidates = [self._sorted_rows[l:h] for l, h in zip(lo, hi) if h > l]
+        tail = np.flatnonzero((self.band_keys[self._indexed:self.size] == keys).any(axis=1))
+        if len(tail):
+            candidates.append(tail + self._indexed)
+        if not candidates:
+            return 0.0
+        rows = np.concatenate(candidates)
+        matches = np.count_nonzero(self.signatures[rows] == signature, axis=1)
+        return float(matches.max()) / self.signatures.shape[1]
+
+
+class QuestionIndex:
+    """
+    Persistent near-duplicate index of generated questions, one per source
+    content. Signatures are stored in SQLite, so every worker (and later
+    generations from the same content) filters against the same history;
+    each worker keeps the signatures of recently used contents in memory
+    (a small LRU) and only reads rows other workers added since its last look.
+    Every method does blocking SQLite work and is meant to run off the event
+    loop.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.threshold = 0.85
+        self.hasher = None
+        self.cache_size = 64
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("DEDUP_ENABLED", True)
+        self.path = app.config.get("DEDUP_INDEX_PATH", "cache/question_index.sqlite3")
+        self.threshold = app.config.get("DEDUP_SIMILARITY_THRESHOLD", 0.85)
+        self.hasher = MinHasher(num_perm=app.config.get("DEDUP_NUM_PERM", 64))
+        self.cache_size = app.config.get("DEDUP_INDEX_CACHE_SIZE", 64)
+        if not self.enabled:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS question_signatures ("
+                " id INTEGER PRIMARY KEY,"
+                " content_key TEXT NOT NULL,"
+                " signature BLOB NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS question_signatures_content "
+                "ON question_signatures (content_key, id)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _index_for(self, key):
+        """The in-memory index for `key`, possibly still behind the database."""
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+            index = self._indexes[key] = _ContentIndex(self.hasher.num_perm)
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _catch_up(conn, key, index):
+        """Adds the rows stored for `key` since the index last looked."""
+        for row_id, blob in conn.execute(
+            "SELECT id, signature FROM question_signatures WHERE content_key = ? AND id > ? ORDER BY id",
+            (key, index.last_row)
+        ):
+            index.append(np.frombuffer(blob, dtype=np.uint32))
+            index.last_row = row_id
+
+    def admit(self, key, questions, limit):
+        """
+        Keeps up to `limit` of `questions` that are not near-duplicates of the
+        indexed ones (or of each other) and records them in the index.
+        Returns (admitted_questions, duplicate_count).
+        """
+        if limit <= 0 or not questions:
+            return [], 0
+        signatures = [self.hasher.signature(q.get("question", "")) for q in questions]
+
+        index = self._index_for(key)
+        try:
+            with index.lock:
+                # The bulk of the rows (all of them, for a content this worker
+                # has not seen yet) is read before taking the write lock.
+                with self._connect() as conn:
+                    self._catch_up(conn, key, index)
+                with self._connect() as conn:
+                    # Holding the write lock from here on keeps another worker
+                    # from admitting a duplicate in between; only what it added
+                    # since the read above is left to load.
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._catch_up(conn, key, index)
+                    admitted, duplicates = self._admit_new(conn, key, index, questions, signatures, limit)
+        except sqlite3.Error as e:
+            error_logger.warning(f"Question index unavailable, skipping de-duplication: {e}")
+            return questions[:limit], 0
+        return admitted, duplicates
+
+    def _admit_new(self, conn, key, index, questions, signatures, limit):
+        admitted = []
+        duplicates = 0
+        now = time.time()
+        for q, signature in zip(questions, signatures):
+            if len(admitted) >= limit:
+                break
+            if index.max_similarity(signature) >= self.threshold:
+                duplicates += 1
+                continue
+            row_id = conn.execute(
+                "INSERT INTO question_signatures (content_key, signature, created_at) VALUES (?, ?, ?)",
+                (key, signature.tobytes(), now)
+            ).lastrowid
+            index.append(signature)
+            index.last_row = row_id
+            admitted.append(q)
+        return admitted, duplicates
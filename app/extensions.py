@@ -1,9 +1,38 @@
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from datetime import timedelta
 from flask import current_app
 from flask_jwt_extended import JWTManager
-import google.generativeai as genai
-from openai import AsyncOpenAI 
+
+from .bank import QuestionBank
+from .cache import ResponseCache, make_cache_key
+from .compression import ResponseCompressor
+from .dedup import QuestionIndex
+from .jobs import JobRunner, JobStore
+from .metrics import ServiceMetrics
+from .retrieval import ContentRetriever
+from .routing import LatencyMonitor
+from .scheduler import RequestScheduler, estimate_tokens
+from .singleflight import SingleFlight
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
 
 jwt = JWTManager()
+metrics = ServiceMetrics()
+response_cache = ResponseCache()
+inflight_generations = SingleFlight(on_coalesced=metrics.coalesced.inc)
+scheduler = RequestScheduler()
+job_store = JobStore()
+job_runner = JobRunner()
+latency_monitor = LatencyMonitor()
+question_index = QuestionIndex()
+question_bank = QuestionBank()
+content_retriever = ContentRetriever()
+response_compressor = ResponseCompressor()
 
 gemini_tool = {
     "name": "submit_questions",
@@ -56,33 +85,270 @@ OPENAI_COMPATIBLE_TOOL = {
     }
 }
 
+# Extended `submit_questions` tool for packed calls that cover several rules:
+# every question is tagged with the questionId of the rule it belongs to.
+gemini_packed_tool = {
+    "name": "submit_questions",
+    "description": "Submits a list of generated questions, each tagged with the questionId of its rule.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "questions": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "questionId": {"type": "INTEGER"},
+                        "question": {"type": "STRING"},
+                        "answer": {"type": "STRING"},
+                        "question_latex": {"type": "STRING"},
+                        "answer_latex": {"type": "STRING"}
+                    },
+                    "required": ["questionId", "question", "answer", "question_latex", "answer_latex"]
+                }
+            }
+        },
+        "required": ["questions"]
+    }
+}
+
+OPENAI_COMPATIBLE_PACKED_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_questions",
+        "description": "Submits a list of generated questions, each tagged with the questionId of its rule.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "questions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "questionId": {"type": "integer"},
+                            "question": {"type": "string"},
+                            "answer": {"type": "string"},
+                            "question_latex": {"type": "string"},
+                            "answer_latex": {"type": "string"}
+                        },
+                        "required": ["questionId", "question", "answer", "question_latex", "answer_latex"]
+                    }
+                }
+            },
+            "required": ["questions"]
+        }
+    }
+}
+
 # --- Asynchronous Client Provider ---
 class AsyncClientProvider:
-    """Provides lazily-initialized async clients."""
+    """
+    Provides lazily-initialized async clients and Gemini models, reused for
+    every call made on the same event loop.
+
+    HTTP connection pools and gRPC channels are bound to the loop that
+    created them, so one set is kept per loop. The uvicorn loop keeps its set
+    for the lifetime of the worker; short-lived loops (streaming and job
+    threads) close theirs with `aclose()` before they exit.
+
+    The provider SDKs are heavy to import, so each is only imported (and the
+    Gemini SDK configured) when its provider is first used, or up front for
+    the providers listed in LLM_WARMUP_PROVIDERS.
+    """
     def __init__(self):
-        self._deepseek_client = None
-        self._openai_client = None
+        self._by_loop = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._sdk_lock = threading.Lock()
+        self._google_api_key = None
+        self._genai = None
+        # Gemini context caches by prefix key: (CachedContent or None, valid_until)
+        self._context_caches = {}
+        self._context_cache_flights = SingleFlight()
+
+    def init_app(self, app):
+        self._google_api_key = app.config['GOOGLE_API_KEY']
+        providers = app.config.get("LLM_WARMUP_PROVIDERS", [])
+        if providers:
+            threading.Thread(
+                target=self.warm_up, args=(providers,), name="llm-sdk-warmup", daemon=True
+            ).start()
+
+    def warm_up(self, providers):
+        """Imports (and configures) the SDKs of `providers` ahead of their first call."""
+        for provider_name in providers:
+            try:
+                if provider_name == 'gemini':
+                    self.genai()
+                else:
+                    import openai  # noqa: F401
+            except Exception as e:
+                error_logger.error(f"Could not warm up the {provider_name} SDK: {e}")
+
+    def genai(self):
+        """The google.generativeai module, imported and configured on first use."""
+        if self._genai is None:
+            with self._sdk_lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self._google_api_key)
+                    app_logger.info("Gemini API configured successfully.")
+                    self._genai = genai
+        return self._genai
+
+    def _clients(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._by_loop.get(loop)
+            if clients is None:
+                clients = self._by_loop[loop] = {}
+        return clients
+
+    def _http_client(self):
+        """Keep-alive connection pool shared by one OpenAI-compatible client."""
+        import httpx
+        from openai import DefaultAsyncHttpxClient, Timeout
+
+        config = current_app.config
+        http2 = config.get("LLM_HTTP2", True)
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        return DefaultAsyncHttpxClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.get("LLM_POOL_MAX_CONNECTIONS", 100),
+                max_keepalive_connections=config.get("LLM_POOL_MAX_KEEPALIVE", 20),
+                keepalive_expiry=config.get("LLM_POOL_KEEPALIVE_SECONDS", 60),
+            ),
+            # The SDK's own Timeout: its HTTP stack does not accept httpx's.
+            timeout=Timeout(
+                config.get("LLM_READ_TIMEOUT_SECONDS", 170),
+                connect=config.get("LLM_CONNECT_TIMEOUT_SECONDS", 10),
+            ),
+        )
 
     @property
     def deepseek(self):
-        if self._deepseek_client is None:
+        clients = self._clients()
+        if 'deepseek' not in clients:
             api_key = current_app.config.get("DEEPSEEK_API_KEY")
             if not api_key:
                 raise ValueError("DEEPSEEK_API_KEY not set in config.")
-            self._deepseek_client = AsyncOpenAI(
+            from openai import AsyncOpenAI
+            clients['deepseek'] = AsyncOpenAI(
                 api_key=api_key,
-                base_url="https://api.deepseek.com/v1"
+                base_url=current_app.config.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+                http_client=self._http_client()
             )
-        return self._deepseek_client
+        return clients['deepseek']
     
     @property
     def openai(self):
-        if self._openai_client is None:
+        clients = self._clients()
+        if 'openai' not in clients:
             api_key = current_app.config.get("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OPENAI_API_KEY not set in config.")
-            self._openai_client = AsyncOpenAI(api_key=api_key)
-        return self._openai_client
+            from openai import AsyncOpenAI
+            clients['openai'] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=current_app.config.get("OPENAI_BASE_URL"),
+                http_client=self._http_client()
+            )
+        return clients['openai']
+
+    @property
+    def gemini(self):
+        return self._gemini_model('gemini', gemini_tool)
+
+    @property
+    def gemini_packed(self):
+        """Gemini model that answers with the questionId-tagged (packed) tool."""
+        return self._gemini_model('gemini-packed', gemini_packed_tool)
+
+    def _gemini_model(self, kind, tool):
+        model_name = current_app.config['GEMINI_MODEL_NAME']
+        clients = self._clients()
+        key = (kind, model_name)
+        if key not in clients:
+            clients[key] = self.genai().GenerativeModel(
+                model_name=model_name,
+                tools=[tool],
+                tool_config={"function_calling_config": "ANY"}
+            )
+        return clients[key]
+
+    async def gemini_with_cached_prefix(self, prefix, packed=False):
+        """
+        Gemini model whose server-side context cache already holds `prefix`
+        (plus the tool definition), so calls only upload the rule-specific part.
+        Returns None when context caching is disabled, the prefix is too small
+        to qualify, or the cache could not be created.
+        """
+        config = current_app.config
+        min_tokens = config.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 4096)
+        if not min_tokens or estimate_tokens(prefix) < min_tokens:
+            return None
+
+        model_name = config['GEMINI_MODEL_NAME']
+        ttl = config.get("GEMINI_CONTEXT_CACHE_TTL_SECONDS", 600)
+        tool = gemini_packed_tool if packed else gemini_tool
+        key = make_cache_key(prefix, 'gemini-context', model_name, int(packed))
+
+        with self._lock:
+            entry = self._context_caches.get(key)
+        if entry is None or entry[1] <= time.time():
+            entry = await self._context_cache_flights.do(
+                key, lambda: self._create_context_cache(key, prefix, model_name, tool, ttl)
+            )
+
+        cached_content = entry[0]
+        if cached_content is None:
+            return None
+        clients = self._clients()
+        client_key = ('gemini-cached', cached_content.name)
+        if client_key not in clients:
+            clients[client_key] = self.genai().GenerativeModel.from_cached_content(cached_content)
+        return clients[client_key]
+
+    async def _create_context_cache(self, key, prefix, model_name, tool, ttl):
+        try:
+            cached_content = await asyncio.to_thread(
+                self.genai().caching.CachedContent.create,
+                model=model_name,
+                system_instruction=prefix,
+                tools=[tool],
+                tool_config={"function_calling_config": "ANY"},
+                ttl=timedelta(seconds=ttl),
+            )
+            # Stop using the cache a minute before the provider expires it.
+            entry = (cached_content, time.time() + max(ttl - 60, ttl / 2))
+        except Exception as e:
+            error_logger.warning(f"Could not create Gemini context cache: {e}")
+            entry = (None, time.time() + 60)
+        with self._lock:
+            now = time.time()
+            expired = {
+                v[0].name for v in self._context_caches.values() if v[1] <= now and v[0] is not None
+            }
+            self._context_caches = {k: v for k, v in self._context_caches.items() if v[1] > now}
+            self._context_caches[key] = entry
+            # Models bound to expired caches would otherwise stay in every loop's clients.
+            for clients in self._by_loop.values():
+                for name in expired:
+                    clients.pop(('gemini-cached', name), None)
+        return entry
+
+    async def aclose(self):
+        """Closes the clients created on the running loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._by_loop.pop(loop, {})
+        for key in ('deepseek', 'openai'):
+            if key in clients:
+                await clients[key].close()
 
 # Instantiate the async provider
 async_clients = AsyncClientProvider()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library is used instead
+    orjson = None
+
+
+# Dates and dataclasses are passed to the `default` hook, so they are encoded
+# exactly as Flask's own provider does (e.g. dates as HTTP dates).
+_ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None else 0
+)
+
+
+def dumps(obj):
+    """Compact JSON text for `obj`, via orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode('utf-8')
+        except TypeError:
+            # Something orjson does not encode (e.g. integers over 64 bits).
+            pass
+    return json.dumps(obj)
+
+
+def loads(data):
+    """Parses JSON text or bytes, via orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The standard library accepts a little more (NaN, lone
+            # surrogates) and raises its own, familiar error messages.
+            pass
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, used for request bodies and every
+    `jsonify` response. Output keeps Flask's defaults (sorted keys, same
+    encoding of dates and other extra types) except that non-ASCII text is
+    written as UTF-8 rather than \\u escapes. Anything orjson cannot handle,
+    and pretty-printed debug output, goes through the standard library.
+    """
+    def _orjson_bytes(self, obj, sort_keys):
+        option = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs.get("indent") and "cls" not in kwargs:
+            try:
+                return self._orjson_bytes(obj, kwargs.get("sort_keys", self.sort_keys)).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = self._orjson_bytes(obj, self.sort_keys)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
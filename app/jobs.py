@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import aclosing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+error_logger = logging.getLogger('error')
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+
+class JobStore:
+    """
+    SQLite-backed store for asynchronous generation jobs. Every worker process
+    pointing at the same file sees the same jobs and their partial results.
+    """
+    def __init__(self):
+        self.path = None
+        self.ttl = 0
+        self.stale_after = 0
+
+    def init_app(self, app):
+        self.path = app.config.get("JOB_STORE_PATH", "jobs/jobs.sqlite3")
+        self.ttl = app.config.get("JOB_TTL_SECONDS", 86400)
+        self.stale_after = app.config.get("JOB_STALE_SECONDS", 600)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " rules_total INTEGER NOT NULL,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " job_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " event TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, seq))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, owner, rules_total):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, owner, status, rules_total, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, JOB_QUEUED, rules_total, now, now, now + self.ttl)
+            )
+        return job_id
+
+    def set_status(self, job_id, status, error=None):
+        """
+        Moves a job to `status`. A job that already finished (or was given up
+        as interrupted) keeps its final status; returns False in that case.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, expires_at = ? "
+                "WHERE id = ? AND status NOT IN (?, ?)",
+                (status, error, now, now + self.ttl, job_id, *TERMINAL_STATUSES)
+            )
+        return cursor.rowcount > 0
+
+    def touch(self, job_ids):
+        """Records that the worker holding these (unfinished) jobs is still alive."""
+        placeholders = ", ".join("?" * len(job_ids))
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE id IN ({placeholders}) AND status IN (?, ?)",
+                (time.time(), *job_ids, JOB_QUEUED, JOB_RUNNING)
+            )
+
+    def add_event(self, job_id, event):
+        now = time.time()
+        with self._connect() as conn:
+            seq = conn.execute(
+                "SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(event))
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def get(self, job_id):
+        """Returns the job with its events, or None if it does not exist or has expired."""
+        now = time.time()
+        with self._connect() as conn:
+            # Workers touch their queued and running jobs regularly, so an
+            # unfinished job without updates for a while lost its worker (it
+            # died or was restarted) and will never finish.
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ? "
+                "WHERE id = ? AND status IN (?, ?) AND updated_at < ?",
+                (JOB_FAILED, "The job was interrupted before it finished.", job_id, JOB_QUEUED, JOB_RUNNING,
+                 now - self.stale_after)
+            )
+            row = conn.execute(
+                "SELECT id, owner, status, rules_total, error, created_at, updated_at, expires_at "
+                "FROM jobs WHERE id = ? AND expires_at > ?", (job_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(
+                ("id", "owner", "status", "rules_total", "error", "created_at", "updated_at", "expires_at"),
+                row
+            ))
+            job["events"] = [
+                json.loads(event) for (event,) in conn.execute(
+                    "SELECT event FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,)
+                )
+            ]
+        return job
+
+    def purge_expired(self):
+        with self._connect() as conn:
+            now = time.time()
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE expires_at <= ?)",
+                (now,)
+            )
+            conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+
+
+class JobRunner:
+    """
+    Runs generation jobs in background threads, each on its own event loop.
+    A heartbeat thread keeps touching the jobs this worker holds, queued or
+    running, so that JobStore only gives up on jobs whose worker is gone.
+    """
+    def __init__(self):
+        self._executor = None
+        self.heartbeat_interval = 200
+        self._active = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def init_app(self, app):
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config.get("JOB_MAX_WORKERS", 4),
+            thread_name_prefix="generation-job"
+        )
+        self.heartbeat_interval = max(app.config.get("JOB_STALE_SECONDS", 600) / 3, 1)
+
+    def submit(self, app, store, job_id, data, events_factory):
+        """
+        Schedules `events_factory(data)` (an async generator of per-rule events)
+        and records every event it yields on the job.
+        """
+        with self._lock:
+            self._active.add(job_id)
+            # Started on first use, so that it runs in the serving process.
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(
+                    target=self._beat, args=(store,), name="generation-job-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+        # The job's log records keep the id of the request that created it.
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, app, store, job_id, data, events_factory)
+
+    def _beat(self, store):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                job_ids = list(self._active)
+            if not job_ids:
+                continue
+            try:
+                store.touch(job_ids)
+            except sqlite3.Error as e:
+                error_logger.warning(f"Could not record generation job heartbeat: {e}")
+
+    def _run(self, app, store, job_id, data, events_factory):
+        try:
+            self._run_job(app, store, job_id, data, events_factory)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    @staticmethod
+    def _run_job(app, store, job_id, data, events_factory):
+        from .extensions import async_clients
+        from .services import ServiceError
+
+        async def consume():
+            try:
+                async with aclosing(events_factory(data)) as events:
+                    async for event in events:
+                        store.add_event(job_id, event)
+            finally:
+                await async_clients.aclose()
+
+        with app.app_context():
+            try:
+                if not store.set_status(job_id, JOB_RUNNING):
+                    error_logger.warning(f"Generation job {job_id} already finished; not running it.")
+                    return
+                asyncio.run(consume())
+            except Exception as e:
+                error_logger.error(f"Generation job {job_id} failed: {e}", exc_info=True)
+                message = str(e) if isinstance(e, ServiceError) else "An internal server error occurred."
+                store.set_status(job_id, JOB_FAILED, message)
+            else:
+                store.set_status(job_id, JOB_COMPLETED)
@@ -0,0 +1,99 @@
+import re
+
+from . import fastjson
+
+
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class ArrayItemParser:
+    """
+    Incremental parser for a streamed JSON object such as the arguments of a
+    `submit_questions` tool call, {"questions": [{...}, {...}]}. Text is fed
+    in arbitrary pieces; each object in the array under `key` is returned as
+    soon as its closing brace arrives, so the items completed before a
+    truncated or interrupted stream are not lost. Items that are not objects
+    are skipped; an object that does not parse is returned as None.
+    """
+    def __init__(self, key="questions"):
+        self.key = key
+        self.complete = False
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = None
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+
+    def feed(self, text):
+        """Consumes the next piece of text and returns the items it completed."""
+        if self.complete:
+            return []
+        buf = self._buffer + text
+        items = []
+        i = self._pos
+        while True:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buf, i)
+                if match is None:
+                    i = len(buf)
+                    break
+                i = match.end()
+                if match.group() == '\\':
+                    if i >= len(buf):
+                        # The escaped character has not arrived yet.
+                        i -= 1
+                        break
+                    i += 1
+                    continue
+                self._in_string = False
+                if self._string_start is not None:
+                    self._last_key = buf[self._string_start:i]
+                    self._string_start = None
+                continue
+
+            match = _STRUCTURAL.search(buf, i)
+            if match is None:
+                i = len(buf)
+                break
+            ch = match.group()
+            i = match.end()
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._string_start = i - 1
+            elif ch in '{[':
+                if self._depth == 1 and ch == '[' and self._last_key is not None \
+                        and fastjson.loads(self._last_key) == self.key:
+                    self._array_depth = 2
+                elif self._depth == self._array_depth and ch == '{':
+                    self._item_start = i - 1
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._item_start is not None and self._depth == self._array_depth:
+                    try:
+                        items.append(fastjson.loads(buf[self._item_start:i]))
+                    except ValueError:
+                        items.append(None)
+                    self._item_start = None
+                elif self._array_depth is not None and self._depth < self._array_depth:
+                    self._array_depth = None
+                if self._depth <= 0:
+                    self.complete = True
+                    break
+
+        # Keep only the text still needed: an unfinished item or key.
+        keep_from = min(
+            (start for start in (self._item_start, self._string_start) if start is not None), default=i
+        )
+        self._buffer = buf[keep_from:]
+        self._pos = i - keep_from
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        if self._string_start is not None:
+            self._string_start -= keep_from
+        return items
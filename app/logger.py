@@ -1,23 +1,123 @@
 import os
 import sys
+import copy
+import json
+import uuid
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import Flask, g, request
+
+# Id of the HTTP request being handled, attached to every log record.
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_listener = None
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the id of the request being handled by the calling thread or task."""
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of records below WARNING; warnings and errors always pass."""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any fields passed with `extra=`."""
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the listener thread with the message and traceback already rendered."""
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _RoutingHandler(logging.Handler):
+    """Runs in the listener thread and passes each record to its logger's real handlers."""
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = routes
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
 
 def setup_logging(app: Flask):
     """
-    Configures a simple, standard logging system that outputs to both
-    the console (stdout) and rotating files.
+    Configures logging to the console (stdout) and rotating files.
+
+    Loggers only put records on an in-memory queue; a single background
+    listener thread formats them and does the actual I/O, so request threads
+    and coroutines never wait on disk. LOG_FORMAT selects "text" or "json"
+    output, and every record carries the id of the request it belongs to.
     """
+    global _listener
+
     log_directories = ["logs/app", "logs/error", "logs/access", "logs/security"]
     for directory in log_directories:
         os.makedirs(directory, exist_ok=True)
 
-    log_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    if app.config.get("LOG_FORMAT", "text") == "json":
+        log_formatter = JsonFormatter()
+    else:
+        log_formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+        )
+    max_bytes = app.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024)
+    backup_count = app.config.get("LOG_BACKUP_COUNT", 5)
 
     log_configs = {
+        app.logger.name: {
+            'level': app.config.get("LOG_LEVEL_APP", "INFO"),
+            'filename': 'logs/app/app.log'
+        },
         'access': {
             'level': app.config.get("LOG_LEVEL_ACCESS", "INFO"),
             'filename': 'logs/access/access.log'
@@ -32,39 +132,50 @@ def setup_logging(app: Flask):
         }
     }
 
-    # --- Configure the root/app logger (Flask's default) ---
-    app.logger.handlers.clear() # Remove any default handlers
-    app.logger.setLevel(app.config.get("LOG_LEVEL_APP", "INFO"))
+    _stop_listener()
 
-    # Add console handler for the app logger
-    app_console_handler = logging.StreamHandler(sys.stdout)
-    app_console_handler.setFormatter(log_formatter)
-    app.logger.addHandler(app_console_handler)
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
 
-    # Add file handler for the app logger
-    app_file_handler = RotatingFileHandler(
-        'logs/app/app.log', maxBytes=100000, backupCount=5, encoding='utf-8'
-    )
-    app_file_handler.setFormatter(log_formatter)
-    app.logger.addHandler(app_file_handler)
-
-    # --- Configure the other named loggers ---
+    routes = {}
     for name, config in log_configs.items():
-        logger = logging.getLogger(name)
-        logger.handlers.clear()
-        logger.setLevel(config['level'])
-        logger.propagate = False 
-
-        # Add console handler
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(log_formatter)
-        logger.addHandler(console_handler)
 
-        # Add file handler
         file_handler = RotatingFileHandler(
-            config['filename'], maxBytes=100000, backupCount=5, encoding='utf-8'
+            config['filename'], maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
         )
         file_handler.setFormatter(log_formatter)
-        logger.addHandler(file_handler)
+        routes[name] = [console_handler, file_handler]
+
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.filters.clear()
+        logger.setLevel(config['level'])
+        logger.propagate = False
+        logger.addHandler(queue_handler)
+
+    sample_rate = app.config.get("LOG_ACCESS_SAMPLE_RATE", 1.0)
+    if sample_rate < 1:
+        logging.getLogger('access').addFilter(SamplingFilter(sample_rate))
+
+    _listener = QueueListener(log_queue, _RoutingHandler(routes))
+    _listener.start()
+    atexit.unregister(_stop_listener)
+    atexit.register(_stop_listener)
+
+    @app.before_request
+    def assign_request_id():
+        # Reuse the caller's id (e.g. from a proxy) when it looks sane.
+        incoming = request.headers.get("X-Request-ID", "")
+        g.request_id = incoming if 0 < len(incoming) <= 64 and incoming.isprintable() else uuid.uuid4().hex
+        request_id_var.set(g.request_id)
+
+    @app.after_request
+    def return_request_id(response):
+        if "request_id" in g:
+            response.headers["X-Request-ID"] = g.request_id
+        return response
 
-    app.logger.info("Simple logging configured to output to stdout and files.")
\ No newline at end of file
+    app.logger.info("Logging configured: records are written to stdout and files by a background thread.")
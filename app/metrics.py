@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import glob
+import logging
+import threading
+
+from flask import g, request
+
+
+error_logger = logging.getLogger('error')
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(total, sample):
+        return sample if total is None else total + sample
+
+    def render(self, samples):
+        if not samples and not self.labelnames:
+            yield f"{self.name} 0"
+        for key, value in samples.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Histogram with fixed buckets and labels."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    @staticmethod
+    def merge(total, sample):
+        if total is None:
+            return [list(sample[0]), sample[1]]
+        return [[a + b for a, b in zip(total[0], sample[0])], total[1] + sample[1]]
+
+    def render(self, samples):
+        for key, (counts, total) in samples.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = (("le", _format_value(float(bound))),)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(total))}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class ServiceMetrics:
+    """
+    Counters and histograms for the service, rendered in the Prometheus text
+    format on /metrics.
+
+    Each uvicorn worker keeps its own metrics in memory and periodically
+    writes a snapshot to METRICS_DIR (one file per worker process); a scrape
+    served by any worker sums the snapshots of all of them. Clear the
+    directory when deploying, as with Prometheus' own multiprocess mode.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self._path = None
+        self._flusher = None
+        self._flush_lock = threading.Lock()
+        self._metrics = []
+
+        self.http_requests = self._add(Counter(
+            "qb_http_requests_total", "HTTP requests handled.", ("method", "endpoint", "status")))
+        self.http_latency = self._add(Histogram(
+            "qb_http_request_duration_seconds", "Time to produce the HTTP response (streams: until headers).",
+            ("method", "endpoint")))
+        self.rule_latency = self._add(Histogram(
+            "qb_rule_duration_seconds", "Time for one rule to finish, by outcome.", ("provider", "status")))
+        self.rule_timeouts = self._add(Counter(
+            "qb_rule_timeouts_total", "Rules cancelled at their deadline.", ("provider",)))
+        self.first_result_latency = self._add(Histogram(
+            "qb_time_to_first_rule_seconds", "Time from the start of a generation to its first finished rule.",
+            ("provider",)))
+        self.queue_latency = self._add(Histogram(
+            "qb_upstream_queue_seconds", "Time upstream calls waited for a scheduler slot.", ("provider",)))
+        self.upstream_latency = self._add(Histogram(
+            "qb_upstream_request_duration_seconds", "Upstream LLM call latency, by outcome.",
+            ("provider", "outcome")))
+        self.upstream_first_question = self._add(Histogram(
+            "qb_upstream_first_question_seconds",
+            "Time from the start of a streamed upstream call to its first valid question.",
+            ("provider",)))
+        self.upstream_tokens = self._add(Counter(
+            "qb_upstream_tokens_total", "Tokens reported by upstream responses.", ("provider", "kind")))
+        self.validation_failures = self._add(Counter(
+            "qb_validation_failures_total", "Upstream answers that failed validation, by kind.",
+            ("provider", "kind")))
+        self.cache_requests = self._add(Counter(
+            "qb_cache_requests_total", "Response cache lookups, by result (hit or miss).", ("result",)))
+        self.coalesced = self._add(Counter(
+            "qb_coalesced_total", "Generations that joined an identical generation already in flight."))
+        self.dedup_dropped = self._add(Counter(
+            "qb_dedup_dropped_total", "Generated questions dropped as near-duplicates."))
+        self.hedges = self._add(Counter(
+            "qb_hedges_total", "Hedged duplicate calls started, by the provider hedged onto.", ("provider",)))
+        self.hedge_wins = self._add(Counter(
+            "qb_hedge_wins_total", "Hedged calls that answered before the original.", ("provider",)))
+        self.failovers = self._add(Counter(
+            "qb_failovers_total", "Calls moved to the next provider after an error, by that provider.",
+            ("provider",)))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        self.directory = app.config.get("METRICS_DIR", "metrics")
+        if not self.enabled:
+            return
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"worker-{os.getpid()}-{int(time.time())}.json")
+            if self._flusher is None:
+                interval = app.config.get("METRICS_FLUSH_SECONDS", 5)
+                self._flusher = threading.Thread(
+                    target=self._flush_periodically, args=(interval,), name="metrics-flush", daemon=True
+                )
+                self._flusher.start()
+
+        @app.before_request
+        def start_request_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            started = g.pop("metrics_started", None)
+            if started is not None:
+                endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+                self.http_requests.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+                self.http_latency.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+            return response
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def flush(self):
+        """Writes this worker's snapshot where the other workers can read it."""
+        if not self._path:
+            return
+        tmp_path = f"{self._path}.tmp"
+        with self._flush_lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self._path)
+
+    def _flush_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError as e:
+                error_logger.warning(f"Could not write metrics snapshot: {e}")
+
+    def _snapshots(self):
+        if not self._path:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced by its worker right now; it is picked up next scrape.
+                continue
+        return snapshots
+
+    def render(self):
+        """All workers' metrics, summed, in the Prometheus text exposition format."""
+        snapshots = self._snapshots()
+        lines = []
+        for metric in self._metrics:
+            merged = {}
+            for snapshot in snapshots:
+                for key, sample in snapshot.get(metric.name, ()):
+                    key = tuple(key)
+                    merged[key] = metric.merge(merged.get(key), sample)
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,211 @@
+import re
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .dedup import content_key
+from .scheduler import estimate_tokens
+
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+_EXCERPT_SEPARATOR = "\n\n[...]\n\n"
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+# Words that tend to appear in passages suited to each cognitive level; they
+# only nudge the ranking, the course outcome carries most of the query.
+_LEVEL_HINTS = {
+    "Remembering": "definition define term list state name",
+    "Understanding": "explain describe summary difference means because",
+    "Applying": "example calculate solve use apply problem",
+    "Analyzing": "compare analysis structure relationship cause effect",
+    "Evaluating": "advantage disadvantage justify assess criteria limitation",
+    "Creating": "design construct develop plan model propose",
+}
+
+
+def _terms(text):
+    return _TERM.findall(text.lower())
+
+
+def _pieces(paragraph, max_chars):
+    """Splits an over-long paragraph at sentence ends, and a run-on sentence at whitespace."""
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            yield sentence
+
+
+def chunk_content(content, chunk_tokens):
+    """
+    Splits content into chunks of about `chunk_tokens` estimated tokens,
+    keeping paragraphs whole where they fit and sentences whole otherwise.
+    """
+    max_chars = chunk_tokens * 4
+    units = []
+    for paragraph in _PARAGRAPH_BREAK.split(content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            units.append((paragraph, "\n\n"))
+        else:
+            units.extend((piece, " ") for piece in _pieces(paragraph, max_chars))
+
+    chunks = []
+    current = ""
+    for text, separator in units:
+        if current and len(current) + len(separator) + len(text) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{separator}{text}" if current else text
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _spread_order(n):
+    """Chunk positions ordered so that any prefix of the order is spread evenly over the content."""
+    if n <= 1:
+        return np.zeros(n, dtype=np.int64)
+    bits = math.ceil(math.log2(n))
+    order = []
+    seen = set()
+    for i in range(1 << bits):
+        reversed_i = int(f"{i:0{bits}b}"[::-1], 2)
+        position = reversed_i * n >> bits
+        if position not in seen:
+            seen.add(position)
+            order.append(position)
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    return rank
+
+
+class ChunkIndex:
+    """
+    BM25 index over the chunks of one content. Postings are kept as flat
+    NumPy arrays sorted by term, so a query only touches the chunks that
+    contain one of its terms.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chunk_tokens = np.array([estimate_tokens(c) for c in chunks], dtype=np.int64)
+        self._spread_rank = _spread_order(len(chunks))
+
+        vocabulary = {}
+        term_ids, chunk_ids, frequencies = [], [], []
+        lengths = np.zeros(len(chunks), dtype=np.float64)
+        for chunk_id, chunk in enumerate(chunks):
+            counts = {}
+            for term in _terms(chunk):
+                counts[term] = counts.get(term, 0) + 1
+            lengths[chunk_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                chunk_ids.append(chunk_id)
+                frequencies.append(count)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        self._vocabulary = vocabulary
+        self._postings_chunks = np.array(chunk_ids, dtype=np.int64)[order]
+        self._postings_tf = np.array(frequencies, dtype=np.float64)[order]
+        self._postings_start = np.searchsorted(term_ids[order], np.arange(len(vocabulary) + 1))
+
+        document_frequency = np.diff(self._postings_start)
+        self._idf = np.log1p((len(chunks) - document_frequency + 0.5) / (document_frequency + 0.5))
+        average_length = lengths.mean() if len(chunks) else 1.0
+        self._length_norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * lengths / max(average_length, 1.0))
+
+    def scores(self, query):
+        scores = np.zeros(len(self.chunks), dtype=np.float64)
+        for term in set(_terms(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self._postings_start[term_id], self._postings_start[term_id + 1]
+            chunks = self._postings_chunks[start:end]
+            tf = self._postings_tf[start:end]
+            scores[chunks] += self._idf[term_id] * tf * (_BM25_K1 + 1) / (tf + self._length_norm[chunks])
+        return scores
+
+    def select(self, query, token_budget):
+        """
+        Ids, in content order, of the best-scoring chunks for `query` that fit
+        in `token_budget`. Chunks that do not match the query at all are
+        chosen spread across the content, so an unmatched query still gets an
+        overview rather than just the opening pages.
+        """
+        order = np.lexsort((self._spread_rank, -self.scores(query)))
+        selected = []
+        used = 0
+        for chunk_id in order:
+            tokens = self.chunk_tokens[chunk_id]
+            if used + tokens > token_budget:
+                continue
+            selected.append(int(chunk_id))
+            used += tokens
+        return tuple(sorted(selected))
+
+    def excerpt(self, chunk_ids):
+        return _EXCERPT_SEPARATOR.join(self.chunks[i] for i in chunk_ids)
+
+
+def rule_query(data, rule):
+    """Retrieval query for a rule: its course outcome, type and cognitive level, plus the module and unit."""
+    return " ".join((
+        rule.get("courseOutcome", ""),
+        rule.get("questionType", ""),
+        rule.get("cognitiveLevel", ""),
+        _LEVEL_HINTS.get(rule.get("cognitiveLevel", ""), ""),
+        data.get("module", ""),
+        data.get("unit", ""),
+    ))
+
+
+class ContentRetriever:
+    """
+    Keeps prompts bounded for very large `content`: content over
+    CONTENT_MAX_PROMPT_TOKENS is split into chunks and indexed, and each rule
+    is given only the chunks most relevant to it, up to that budget. Indexes
+    of recently used contents are kept in a small per-worker LRU.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.max_prompt_tokens = 6000
+        self.chunk_tokens = 400
+        self.cache_size = 16
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("CONTENT_RETRIEVAL", True)
+        self.max_prompt_tokens = app.config.get("CONTENT_MAX_PROMPT_TOKENS", 6000)
+        self.chunk_tokens = min(app.config.get("CONTENT_CHUNK_TOKENS", 400), self.max_prompt_tokens)
+        self.cache_size = app.config.get("CONTENT_INDEX_CACHE_SIZE", 16)
+
+    def index_for(self, content):
+        """The chunk index of `content`, or None when it fits in a prompt as is."""
+        if not self.enabled or estimate_tokens(content) <= self.max_prompt_tokens:
+            return None
+        key = content_key(content)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = ChunkIndex(chunk_content(content, self.chunk_tokens))
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+        return index
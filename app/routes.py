@@ -1,24 +1,42 @@
 import logging
-from flask import Blueprint, request, jsonify, current_app
+from contextlib import aclosing
+from flask import Blueprint, Response, request, jsonify, current_app, url_for
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from marshmallow import ValidationError
-from .schemas import LoginSchema, GenerateSchema
-from .services import generate_questions_from_prompt_async
+from .extensions import async_clients, job_store, job_runner, metrics
+from .metrics import PROMETHEUS_MIMETYPE
+from .schemas import LoginSchema, load_bulk_request, load_generate_request
+from .services import (
+    ServiceError, generate_bulk_questions_async, generate_questions_from_prompt_async,
+    stream_bulk_questions, stream_questions_by_rule
+)
+from .streaming import (
+    NDJSON_MIMETYPE, SSE_MIMETYPE, format_ndjson, format_sse, iterate_async_in_thread
+)
 
 main_bp = Blueprint('main', __name__)
 
 access_logger = logging.getLogger('access')
 security_logger = logging.getLogger('security')
 app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# Schemas keep no per-call state, so each is built once and reused.
+login_schema = LoginSchema()
 
 
 @main_bp.before_app_request
 def log_request_info():
     """Logs every incoming request to the access log."""
-    if request.path != '/':
+    if request.path not in ('/', '/metrics'):
+        # Arguments are only formatted if the record survives sampling.
         access_logger.info(
-            f"Incoming request: {request.method} {request.path} "
-            f"from {request.remote_addr} | User-Agent: {request.user_agent.string}"
+            "Incoming request: %s %s from %s | User-Agent: %s",
+            request.method, request.path, request.remote_addr, request.user_agent.string,
+            extra={
+                "method": request.method, "path": request.path,
+                "remote_addr": request.remote_addr, "user_agent": request.user_agent.string,
+            }
         )
 
 @main_bp.route("/", methods=["GET"])
@@ -30,8 +48,11 @@ def index():
         "available_endpoints": [
             "/",
             "/health",
+            "/metrics",
             "/login",
-            "/generate_questions"
+            "/generate_questions",
+            "/generate_questions/bulk",
+            "/generate_questions/jobs"
         ]
     }), 200
 
@@ -47,7 +68,9 @@ def handle_all(path):
         "available_endpoints": [
             "/",
             "/login",
-            "/generate_questions"
+            "/generate_questions",
+            "/generate_questions/bulk",
+            "/generate_questions/jobs"
         ]
     }), 404
 
@@ -60,11 +83,18 @@ def health_check():
         "version": "1.0.0"
     }), 200
 
+@main_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus metrics, summed over all worker processes."""
+    if not metrics.enabled:
+        return jsonify({"error": "Not Found", "message": "Metrics are disabled"}), 404
+    return Response(metrics.render(), content_type=PROMETHEUS_MIMETYPE)
+
 @main_bp.route("/login", methods=["POST"])
 def login():
     """Authenticates a user and returns a JWT."""
     # The global error handler in __init__.py will catch any ValidationError
-    data = LoginSchema().load(request.json)
+    data = login_schema.load(request.json)
     username = data["username"]
     password = data["password"]
 
@@ -81,17 +111,202 @@ def login():
         return jsonify({"error": "Bad username or password"}), 401
 
 
+def requested_stream_format():
+    """
+    Returns "ndjson" or "sse" when the client asked for a streamed response via
+    the `stream` query parameter or the Accept header, otherwise None.
+    """
+    stream_arg = request.args.get("stream", "").lower()
+    if stream_arg in ("ndjson", "sse"):
+        return stream_arg
+    if stream_arg in ("1", "true"):
+        return "ndjson"
+
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE, SSE_MIMETYPE])
+    if best == NDJSON_MIMETYPE:
+        return "ndjson"
+    if best == SSE_MIMETYPE:
+        return "sse"
+    return None
+
+
+def _stream_failure_event(e):
+    """Final `error` event for a stream that could not be completed."""
+    if isinstance(e, ServiceError):
+        return {"event": "error", "message": str(e), "status_code": e.status_code}
+    error_logger.error(f"Unhandled Exception while streaming: {e}", exc_info=True)
+    return {"event": "error", "message": "An internal server error occurred.", "status_code": 500}
+
+
+def _stream_generation(app, validated_data, stream_format, make_events=stream_questions_by_rule):
+    """
+    Yields formatted per-rule events followed by a final `done` or `error` event.
+    Generation runs on its own event loop in a background thread.
+    """
+    formatter = format_sse if stream_format == "sse" else format_ndjson
+    total = 0
+    try:
+        events = iterate_async_in_thread(app, lambda: make_events(validated_data))
+        for event in events:
+            if event["event"] == "rule":
+                total += len(event["generated_questions"])
+            yield formatter(event)
+    except Exception as e:
+        yield formatter(_stream_failure_event(e))
+    else:
+        app_logger.info(f"Successfully streamed {total} questions.")
+        yield formatter({"event": "done", "total_questions": total})
+
+
+async def stream_generation_async(validated_data, stream_format, make_events=stream_questions_by_rule):
+    """Same events as `_stream_generation`, produced on the caller's event loop."""
+    formatter = format_sse if stream_format == "sse" else format_ndjson
+    total = 0
+    try:
+        async with aclosing(make_events(validated_data)) as events:
+            async for event in events:
+                if event["event"] == "rule":
+                    total += len(event["generated_questions"])
+                yield formatter(event)
+    except Exception as e:
+        yield formatter(_stream_failure_event(e))
+    else:
+        app_logger.info(f"Successfully streamed {total} questions.")
+        yield formatter({"event": "done", "total_questions": total})
+
+
+def stream_mimetype(stream_format):
+    return SSE_MIMETYPE if stream_format == "sse" else NDJSON_MIMETYPE
+
+
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def load_generation_request():
+    """Validates the body of a generation request made by an authenticated user."""
+    user_identity = get_jwt_identity()
+    app_logger.info(f"Generation endpoint accessed by user '{user_identity}'")
+    validated_data = load_generate_request(request.json)
+    # The question bank never hands the same question to the same user twice.
+    validated_data['requestedBy'] = user_identity
+    return validated_data
+
+
+def load_bulk_generation_request():
+    """Validates the body of a bulk request; returns the validated papers."""
+    user_identity = get_jwt_identity()
+    papers = load_bulk_request(request.json, current_app.config.get("BULK_MAX_PAPERS", 50))
+    app_logger.info(f"Bulk generation endpoint accessed by user '{user_identity}' for {len(papers)} papers")
+    for paper in papers:
+        paper['requestedBy'] = user_identity
+    return papers
+
+
+async def buffered_bulk_response(papers):
+    result = await generate_bulk_questions_async(papers)
+
+    app_logger.info(
+        f"Successfully generated {sum(len(p['generated_questions']) for p in result['papers'])} questions "
+        f"for {len(result['papers'])} papers."
+    )
+    return jsonify(result)
+
+
+async def buffered_generation_response(validated_data):
+    result = await generate_questions_from_prompt_async(validated_data)
+
+    app_logger.info(
+        f"Successfully generated {len(result['generated_questions'])} questions."
+    )
+    return jsonify(result)
+
+
+async def _on_request_loop(response):
+    """
+    Awaits a buffered generation in a Flask async view. Flask runs each such
+    view on an event loop of its own that ends with the request, so the
+    provider clients opened on it are closed afterwards, as the streaming and
+    job threads do. (The native ASGI routes share uvicorn's loop and keep theirs.)
+    """
+    try:
+        return await response
+    finally:
+        await async_clients.aclose()
+
+
 @main_bp.route('/generate_questions', methods=['POST'])
 @jwt_required()
 async def generate_questions_endpoint():
+    validated_data = load_generation_request()
+
+    stream_format = requested_stream_format()
+    if stream_format:
+        return Response(
+            _stream_generation(current_app._get_current_object(), validated_data, stream_format),
+            mimetype=stream_mimetype(stream_format),
+            headers=STREAM_HEADERS
+        )
+
+    return await _on_request_loop(buffered_generation_response(validated_data))
+
+@main_bp.route('/generate_questions/bulk', methods=['POST'])
+@jwt_required()
+async def generate_bulk_questions_endpoint():
+    """Generates many papers in one request; results are reported per paper."""
+    papers = load_bulk_generation_request()
+
+    stream_format = requested_stream_format()
+    if stream_format:
+        return Response(
+            _stream_generation(current_app._get_current_object(), papers, stream_format, stream_bulk_questions),
+            mimetype=stream_mimetype(stream_format),
+            headers=STREAM_HEADERS
+        )
+
+    return await _on_request_loop(buffered_bulk_response(papers))
+
+@main_bp.route('/generate_questions/jobs', methods=['POST'])
+@jwt_required()
+def create_generation_job():
+    """Starts a background generation job and returns its id immediately."""
     user_identity = get_jwt_identity()
-    app_logger.info(f"Generation endpoint accessed by user '{user_identity}'")
-    
-    validated_data = GenerateSchema().load(request.json)
-    
-    generated_questions = await generate_questions_from_prompt_async(validated_data)
+    validated_data = load_generate_request(request.json)
+    validated_data['requestedBy'] = user_identity
 
-    app_logger.info(
-        f"Successfully generated {len(generated_questions)} questions."
+    job_store.purge_expired()
+    job_id = job_store.create(user_identity, len(validated_data['Rules']))
+    job_runner.submit(
+        current_app._get_current_object(), job_store, job_id,
+        validated_data, stream_questions_by_rule
     )
-    return jsonify({"generated_questions": generated_questions})
\ No newline at end of file
+
+    app_logger.info(f"Generation job {job_id} queued for user '{user_identity}'")
+    status_url = url_for('main.get_generation_job', job_id=job_id)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+
+@main_bp.route('/generate_questions/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_generation_job(job_id):
+    """Reports a job's status together with the results of every rule finished so far."""
+    job = job_store.get(job_id)
+    if job is None or job["owner"] != get_jwt_identity():
+        return jsonify({"error": "Not Found", "message": f"Job '{job_id}' does not exist or has expired"}), 404
+
+    rule_events = sorted(
+        (e for e in job["events"] if e["event"] == "rule"), key=lambda e: e["index"]
+    )
+    errors = [e for e in job["events"] if e["event"] == "error"]
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "error": job["error"],
+        "rules_total": job["rules_total"],
+        "rules_completed": len(rule_events) + len(errors),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "expires_at": job["expires_at"],
+        "generated_questions": [q for e in rule_events for q in e["generated_questions"]],
+        "rule_stats": [{"questionId": e["questionId"], **e["stats"]} for e in rule_events],
+        "errors": errors,
+    })
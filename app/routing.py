@@ -0,0 +1,107 @@
+import math
+import asyncio
+import logging
+import threading
+from collections import deque
+
+
+error_logger = logging.getLogger('error')
+
+
+class LatencyMonitor:
+    """Keeps a rolling window of successful upstream call latencies per provider."""
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, provider_name, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(provider_name, deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def percentile(self, provider_name, pct, min_samples):
+        """Latency at `pct` for the provider, or None until `min_samples` were seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(provider_name, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))
+        return samples[index]
+
+
+async def call_with_routing(providers, call, hedge_delay, record=None):
+    """
+    Runs `call(provider_name, mark_started)` against `providers` in order.
+
+    Any error fails over to the next provider. When `hedge_delay(provider_name)`
+    returns a number of seconds and the running call has not finished that long
+    after it called `mark_started()` (i.e. after it left any local queue and went
+    upstream), one hedged duplicate is started on the next provider. The first
+    success wins and every other call is cancelled. Raises the first error if all fail.
+    Routing decisions are reported as `record(event, provider_name)`, with event
+    "hedged" or "failover" (naming the provider started) or "hedge_won".
+    """
+    loop = asyncio.get_running_loop()
+    remaining = list(providers)
+    running = {}
+    started = {}
+    errors = []
+    hedged = False
+    if record is None:
+        def record(event, provider_name):
+            pass
+
+    def launch():
+        provider_name = remaining.pop(0)
+        started_at = loop.create_future()
+
+        def mark_started():
+            if not started_at.done():
+                started_at.set_result(loop.time())
+
+        task = asyncio.ensure_future(call(provider_name, mark_started))
+        running[task] = provider_name
+        started[task] = started_at
+        return provider_name
+
+    launch()
+    try:
+        while running:
+            waiting = set(running)
+            timeout = None
+            if not hedged and remaining and len(running) == 1:
+                task, provider_name = next(iter(running.items()))
+                if not started[task].done():
+                    # Time spent waiting to be sent does not count toward the hedge delay.
+                    waiting.add(started[task])
+                else:
+                    delay = hedge_delay(provider_name)
+                    if delay is not None:
+                        timeout = max(0, delay - (loop.time() - started[task].result()))
+
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            done -= set(started.values())
+            if timeout is not None and not done:
+                hedged = True
+                record("hedged", launch())
+                continue
+
+            for task in done:
+                provider_name = running.pop(task)
+                started.pop(task)
+                error = task.exception()
+                if error is None:
+                    if hedged and provider_name != providers[0]:
+                        record("hedge_won", provider_name)
+                    return task.result()
+                errors.append(error)
+                error_logger.warning(f"Upstream call to {provider_name} failed: {error}")
+
+            if not running and remaining:
+                record("failover", launch())
+
+        raise errors[0]
+    finally:
+        for task in running:
+            task.cancel()
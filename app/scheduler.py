@@ -0,0 +1,240 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+
+error_logger = logging.getLogger('error')
+
+PROVIDERS = ('gemini', 'openai', 'deepseek')
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting."""
+    return max(1, len(text) // 4)
+
+
+class _SharedBudget:
+    """
+    Requests- and tokens-per-minute budgets of one provider: token buckets
+    that refill continuously up to their per-minute limit. The buckets live in
+    SQLite, so every worker process pointing at the same file draws from one
+    budget instead of each spending the whole provider quota.
+    """
+    def __init__(self, path, provider_name, requests_per_minute=0, tokens_per_minute=0):
+        self.path = path
+        self.provider_name = provider_name
+        self.capacities = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.enabled = any(self.capacities.values())
+        if not self.enabled:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS provider_budgets ("
+                " provider TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " available REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (provider, kind))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def try_take(self, tokens):
+        """
+        Takes one request and `tokens` if both budgets allow it. Returns 0 when
+        taken, else the seconds until they can be.
+        """
+        if not self.enabled:
+            return 0
+        amounts = {"requests": 1, "tokens": tokens}
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                levels = {}
+                wait = 0
+                for kind, capacity in self.capacities.items():
+                    if not capacity:
+                        continue
+                    row = conn.execute(
+                        "SELECT available, updated_at FROM provider_budgets WHERE provider = ? AND kind = ?",
+                        (self.provider_name, kind)
+                    ).fetchone()
+                    available = capacity if row is None else min(
+                        capacity, row[0] + (now - row[1]) * capacity / 60
+                    )
+                    amount = min(amounts[kind], capacity)
+                    levels[kind] = available - amount
+                    if available < amount:
+                        wait = max(wait, (amount - available) * 60 / capacity)
+                if wait:
+                    return wait
+                conn.executemany(
+                    "INSERT OR REPLACE INTO provider_budgets (provider, kind, available, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(self.provider_name, kind, level, now) for kind, level in levels.items()]
+                )
+        except sqlite3.Error as e:
+            error_logger.warning(f"Provider budget unavailable for {self.provider_name}, not limiting: {e}")
+        return 0
+
+
+class _Waiter:
+    __slots__ = ('future', 'tokens')
+
+    def __init__(self, tokens):
+        self.future = concurrent.futures.Future()
+        self.tokens = tokens
+
+
+class ProviderLimiter:
+    """
+    Admits upstream calls for one provider under a per-worker concurrency cap
+    and a (shared) requests/tokens-per-minute budget. Waiting calls are queued
+    per HTTP request and served round-robin, so one large paper cannot starve
+    others.
+
+    Grants are made by a pump thread, which keeps the budget's SQLite work off
+    the event loops, and are delivered through `concurrent.futures.Future`
+    because callers may run on different event loops in different threads.
+    """
+    def __init__(self, name, max_concurrency=0, budget=None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.budget = budget
+        self.active = 0
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pump_thread = None
+
+    async def acquire(self, request_id, tokens):
+        waiter = _Waiter(tokens)
+        with self._lock:
+            self._queues.setdefault(request_id, deque()).append(waiter)
+            if self._pump_thread is None:
+                self._pump_thread = threading.Thread(
+                    target=self._pump, name=f"scheduler-{self.name}", daemon=True
+                )
+                self._pump_thread.start()
+            self._wakeup.notify()
+
+        try:
+            await asyncio.wrap_future(waiter.future)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release()
+                else:
+                    self._discard(request_id, waiter)
+            raise
+
+    def release(self):
+        with self._lock:
+            self._release()
+
+    def queued(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _release(self):
+        self.active -= 1
+        self._wakeup.notify()
+
+    def _discard(self, request_id, waiter):
+        queue = self._queues.get(request_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[request_id]
+
+    def _pump(self):
+        """Grants queued calls, in turn, as the limits allow."""
+        while True:
+            with self._lock:
+                while not self._queues or (self.max_concurrency and self.active >= self.max_concurrency):
+                    self._wakeup.wait()
+                request_id, queue = next(iter(self._queues.items()))
+                waiter = queue[0]
+
+            wait = self.budget.try_take(waiter.tokens) if self.budget is not None else 0
+            with self._lock:
+                if wait > 0:
+                    # New calls and releases wake the pump early; it then checks again.
+                    self._wakeup.wait(wait)
+                    continue
+                if self._queues.get(request_id) is not queue or queue[0] is not waiter:
+                    # Cancelled while the budget was checked; its share is not returned.
+                    continue
+                queue.popleft()
+                # Rotate this request to the back of the line for fairness.
+                del self._queues[request_id]
+                if queue:
+                    self._queues[request_id] = queue
+
+                if not waiter.future.set_running_or_notify_cancel():
+                    continue
+                self.active += 1
+                waiter.future.set_result(None)
+
+
+class RequestScheduler:
+    """Holds one ProviderLimiter per provider, configured from the app config."""
+    def __init__(self):
+        self._limiters = {}
+
+    def init_app(self, app):
+        budget_path = app.config.get("SCHEDULER_BUDGET_PATH", "cache/provider_budgets.sqlite3")
+        self._limiters = {
+            name: ProviderLimiter(
+                name,
+                max_concurrency=app.config.get(f"{name.upper()}_MAX_CONCURRENCY", 0),
+                budget=_SharedBudget(
+                    budget_path, name,
+                    requests_per_minute=app.config.get(f"{name.upper()}_REQUESTS_PER_MINUTE", 0),
+                    tokens_per_minute=app.config.get(f"{name.upper()}_TOKENS_PER_MINUTE", 0),
+                ),
+            )
+            for name in PROVIDERS
+        }
+
+    @asynccontextmanager
+    async def slot(self, provider_name, request_id, tokens):
+        """Waits for capacity on `provider_name` and holds it for the block."""
+        limiter = self._limiters.get(provider_name)
+        if limiter is None:
+            yield
+            return
+
+        await limiter.acquire(request_id, tokens)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def stats(self):
+        return {
+            name: {"active": limiter.active, "queued": limiter.queued()}
+            for name, limiter in self._limiters.items()
+        }
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, ValidationError, fields, validate
 
 class LoginSchema(Schema):
     username = fields.Str(required=True)
@@ -17,6 +17,8 @@ class RuleSchema(Schema):
     numberOfQuestions = fields.Int(required=True, validate=lambda n: n > 0)
     courseOutcome = fields.Str(required=True)
 
+PROVIDERS = ["gemini", "openai", "deepseek"]
+
 class GenerateSchema(Schema):
     module = fields.Str(required=True)
     unit = fields.Str(required=False, load_default="")
@@ -25,13 +27,122 @@ class GenerateSchema(Schema):
     BookDetails = fields.List(fields.Nested(BookDetailsSchema), required=True)
     model = fields.Str(
         required=True,
-        validate=validate.OneOf(["gemini", "openai", "deepseek"])
+        validate=validate.OneOf(PROVIDERS)
+    )
+    # Providers to fail over to, or hedge with, when `model` is slow or errors.
+    fallbackModels = fields.List(
+        fields.Str(validate=validate.OneOf(PROVIDERS)),
+        required=False,
+        load_default=None
+    )
+    useCache = fields.Bool(required=False, load_default=True)
+    # Drop near-duplicates of questions already generated from the same content.
+    deduplicate = fields.Bool(required=False, load_default=False)
+    # Fill rules from the question bank first; only the shortfall is generated.
+    useQuestionBank = fields.Bool(required=False, load_default=False)
+    # Only use banked questions generated within this many days.
+    questionBankMaxAgeDays = fields.Float(
+        required=False,
+        load_default=None,
+        validate=validate.Range(min=0, min_inclusive=False)
     )
+    # Overall time budget for this request; can only shorten REQUEST_TIMEOUT_SECONDS.
+    timeoutSeconds = fields.Float(
+        required=False,
+        load_default=None,
+        validate=validate.Range(min=1)
+    )
+
+# Schemas keep no per-call state, so each is built once and reused.
+_generate_schema = GenerateSchema()
+_generate_schema_without_rules = GenerateSchema(exclude=("Rules",))
+
+_RULE_FIELD_TYPES = {
+    "questionId": int,
+    "questionType": str,
+    "difficultyLevel": str,
+    "cognitiveLevel": str,
+    "mark": int,
+    "numberOfQuestions": int,
+    "courseOutcome": str,
+}
+
+
+def _well_formed_rules(rules):
+    """
+    Copies of `rules` when every rule has exactly the shape RuleSchema
+    accepts unchanged, else None (the schema then validates them and
+    reports the errors).
+    """
+    if type(rules) is not list:
+        return None
+    for rule in rules:
+        if type(rule) is not dict or rule.keys() != _RULE_FIELD_TYPES.keys():
+            return None
+        for key, value in rule.items():
+            if type(value) is not _RULE_FIELD_TYPES[key]:
+                return None
+        if rule["numberOfQuestions"] <= 0:
+            return None
+    return [dict(rule) for rule in rules]
+
+
+def load_generate_request(data):
+    """
+    GenerateSchema().load(data), with the rule list (the bulk of a large
+    request) checked by hand when it is well formed. Invalid input is always
+    loaded by the full schema, so error messages are unchanged.
+    """
+    rules = _well_formed_rules(data.get("Rules")) if type(data) is dict else None
+    if rules is None:
+        return _generate_schema.load(data)
+    validated = _generate_schema_without_rules.load({k: v for k, v in data.items() if k != "Rules"})
+    validated["Rules"] = rules
+    return validated
+
+
+class BulkPaperSchema(GenerateSchema):
+    # Caller's label for the paper, echoed back with its results.
+    paperId = fields.Str(required=False, load_default=None)
+
+class BulkGenerateSchema(Schema):
+    papers = fields.List(fields.Nested(BulkPaperSchema), required=True, validate=validate.Length(min=1))
 
-class _LLMQuestionSchema(Schema):
+_bulk_generate_schema = BulkGenerateSchema()
+
+
+def load_bulk_request(data, max_papers=0):
+    """
+    BulkGenerateSchema().load(data)["papers"], validating each paper like
+    load_generate_request. Any invalid paper makes the full schema report
+    the errors of the whole request, in its usual format.
     """
-    INTERNAL: Validates the structure of a SINGLE question object
-    as returned by the LLM tool call.
+    papers = data.get("papers") if type(data) is dict and data.keys() == {"papers"} else None
+    if type(papers) is not list or not papers:
+        return _bulk_generate_schema.load(data)["papers"]
+    if max_papers and len(papers) > max_papers:
+        raise ValidationError({"papers": [f"At most {max_papers} papers per request."]})
+    try:
+        validated = []
+        for paper in papers:
+            if type(paper) is not dict:
+                raise ValidationError("Invalid paper.")
+            paper_id = paper.get("paperId")
+            if paper_id is not None and type(paper_id) is not str:
+                raise ValidationError("Invalid paperId.")
+            loaded = load_generate_request({k: v for k, v in paper.items() if k != "paperId"})
+            loaded["paperId"] = paper_id
+            validated.append(loaded)
+        return validated
+    except ValidationError:
+        return _bulk_generate_schema.load(data)["papers"]
+
+
+class LLMQuestionSchema(Schema):
+    """
+    PUBLIC: Validates the structure of a SINGLE question object
+    as returned by the LLM tool call. Also used on its own to keep
+    the valid questions of a partially malformed payload.
     """
     question = fields.Str(required=True)
     answer = fields.Str(required=True)
@@ -44,6 +155,22 @@ class LLMToolOutputSchema(Schema):
     from the LLM's tool call.
     """
     questions = fields.List(
-        fields.Nested(_LLMQuestionSchema()),
+        fields.Nested(LLMQuestionSchema()),
         required=True
-    )
\ No newline at end of file
+    )
+
+class LLMPackedQuestionSchema(LLMQuestionSchema):
+    """
+    PUBLIC: A single question from a packed tool call covering several
+    rules, tagged with the questionId of the rule it answers.
+    """
+    questionId = fields.Int(required=True)
+
+class LLMPackedToolOutputSchema(Schema):
+    """
+    PUBLIC: Validates the arguments payload of a packed tool call.
+    """
+    questions = fields.List(
+        fields.Nested(LLMPackedQuestionSchema()),
+        required=True
+    )
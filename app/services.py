@@ -1,14 +1,31 @@
+import sys
 import logging
-import json
+import hashlib
 import asyncio
+import uuid
+import random
+import time
+from collections import namedtuple
+from contextlib import aclosing
 from flask import current_app
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
 from marshmallow import ValidationError
-from openai import APIError
 
-from .extensions import gemini_tool, OPENAI_COMPATIBLE_TOOL, async_clients
-from .schemas import LLMToolOutputSchema
+from . import fastjson
+from .bank import bank_scope
+from .cache import make_cache_key
+from .dedup import content_key
+from .jsonstream import ArrayItemParser
+from .retrieval import rule_query
+from .extensions import (
+    OPENAI_COMPATIBLE_TOOL, OPENAI_COMPATIBLE_PACKED_TOOL, async_clients,
+    response_cache, inflight_generations, scheduler, latency_monitor, question_index, question_bank,
+    content_retriever, metrics
+)
+from .routing import call_with_routing
+from .scheduler import estimate_tokens
+from .schemas import (
+    LLMPackedQuestionSchema, LLMPackedToolOutputSchema, LLMQuestionSchema, LLMToolOutputSchema
+)
 
 
 error_logger = logging.getLogger('error')
@@ -20,17 +37,24 @@ class ServiceError(Exception):
         super().__init__(message)
         self.status_code = status_code
 
-def generate_prompt(module, unit, rule, num_questions, book_details, content):
+PromptParts = namedtuple('PromptParts', ['prefix', 'suffix'])
+
+
+def generate_prompt_prefix(module, unit, book_details, content):
+    """
+    The part of every prompt that is the same for all rules of a request:
+    content, module, unit, book references and the general rules. It is built
+    once per request and sent first so that providers can cache it.
+    """
     book_references = "\n".join([f"- {b['BookName']} (Type: {b['BookType']})" for b in book_details])
-    course_outcome = rule.get('courseOutcome', '')
     unit_line = f"Unit: {unit}" if unit else ""
 
-    prompt = f"""
-    Task: Generate exactly {num_questions} questions based ONLY on the provided content.
+    return f"""
+    You generate exam questions based ONLY on the provided content.
 
     RESPONSE CONTRACT (MANDATORY):
     - You MUST respond with exactly one function call to the `submit_questions` tool.
-    - The `questions` argument MUST be a JSON array containing exactly {num_questions} question objects.
+    - The `questions` argument MUST be a JSON array containing exactly the number of question objects requested in the task.
     - Your ENTIRE response must be that single function call: no text before or after it, no markdown, no commentary.
     - The JSON MUST be complete and valid. A partial, truncated, or malformed response will be rejected.
 
@@ -41,14 +65,7 @@ def generate_prompt(module, unit, rule, num_questions, book_details, content):
     {book_references}
 
     Follow these rules for each question:
-    1.  **Parameters**:
-        - Question Type: {rule['questionType']}
-        - Difficulty: {rule['difficultyLevel']}
-        - Cognitive Level: {rule['cognitiveLevel']}
-        - Marks: {rule['mark']}
-        - Course Outcome: {course_outcome}
-
-    2.  **Cognitive Level Guide**: Align the question with the requested "{rule['cognitiveLevel']}" level using these examples as a structural guide:
+    1.  **Cognitive Level Guide**: Align the question with the requested cognitive level using these examples as a structural guide:
         - Remembering: "State the formula for...", "List the components of...", "Identify the correct term..."
         - Understanding: "Explain the difference between...", "Summarize the process of...", "Describe how X works..."
         - Applying: "Calculate the value of X given...", "Use the theorem to solve...", "Write a function that..."
@@ -56,147 +73,1275 @@ def generate_prompt(module, unit, rule, num_questions, book_details, content):
         - Evaluating: "Assess the effectiveness of...", "Justify the use of Method A over Method B..."
         - Creating: "Design a system that...", "Formulate a new equation for...", "Build a comprehensive layout..."
 
-    3.  **Course Outcome Alignment**: Ensure the question directly tests or maps to the stated Course Outcome: "{course_outcome}".
-
-    4.  **Output Schema (MANDATORY)**: Each object in the `questions` array MUST be a valid JSON object containing ONLY these 4 keys, all with string values:
+    2.  **Output Schema (MANDATORY)**: Each object in the `questions` array MUST be a valid JSON object containing ONLY these 4 keys, all with string values:
         - "question"
         - "answer"
         - "question_latex"
         - "answer_latex"
-        Exactly {num_questions} objects must be returned. No missing keys and no extra keys.
+        No missing keys and no extra keys.
+
+    3.  **MCQ Rule**: If Question Type is "Multiple Choice(MCQ)", the "question" must contain options A, B, C, D, and the "answer" must be only the correct letter (e.g., "C").
+
+    4.  **LaTeX**: Use LaTeX in the "_latex" fields for mathematical content. If none is needed, copy the plain text.
+
+    5.  **Language Rule**: Use the language of the title of the reference book/textbook. (e.g., for a Malayalam book, the response should also be in Malayalam.)
 
-    5.  **MCQ Rule**: If Question Type is "Multiple Choice(MCQ)", the "question" must contain options A, B, C, D, and the "answer" must be only the correct letter (e.g., "C").
+    6.  **Mathematics Rule**: If the reference book and module relate to Mathematics, the questions should be mathematical, i.e., more numerical problems rather than theoretical ones.
+    """
+
+
+def generate_rule_prompt(rule, num_questions, batch_index=0, batch_count=1, exclude_questions=()):
+    """The rule-specific task that follows the shared prefix."""
+    course_outcome = rule.get('courseOutcome', '')
+    batch_line = (
+        f"Batch: This is batch {batch_index + 1} of {batch_count} for these same parameters. "
+        f"Cover a different part of the content than the other batches so that no question is repeated."
+        if batch_count > 1 else ""
+    )
+    exclude_line = (
+        "Already generated (do NOT repeat or rephrase any of these):\n"
+        + "\n".join(f"    - {q[:200]}" for q in exclude_questions)
+        if exclude_questions else ""
+    )
+
+    return f"""
+    Task: Generate exactly {num_questions} questions based ONLY on the provided content.
+    The `questions` argument MUST contain exactly {num_questions} question objects.
+    {batch_line}
+    {exclude_line}
+
+    1.  **Parameters**:
+        - Question Type: {rule['questionType']}
+        - Difficulty: {rule['difficultyLevel']}
+        - Cognitive Level: {rule['cognitiveLevel']}
+        - Marks: {rule['mark']}
+        - Course Outcome: {course_outcome}
 
-    6.  **Answer Length**: For {rule['mark']} marks, provide a concise but complete answer. For marks > 5, be less descriptive.
+    2.  **Cognitive Level**: Align the question with the requested "{rule['cognitiveLevel']}" level.
 
-    7.  **LaTeX**: Use LaTeX in the "_latex" fields for mathematical content. If none is needed, copy the plain text.
+    3.  **Course Outcome Alignment**: Ensure the question directly tests or maps to the stated Course Outcome: "{course_outcome}".
+
+    4.  **Answer Length**: For {rule['mark']} marks, provide a concise but complete answer. For marks > 5, be less descriptive.
+    """
 
-    8.  **Language Rule**: Use the language of the title of the reference book/textbook. (e.g., for a Malayalam book, the response should also be in Malayalam.)
 
-    9.  **Mathematics Rule**: If the reference book and module relate to Mathematics, the questions should be mathematical, i.e., more numerical problems rather than theoretical ones.
+def generate_packed_rule_prompt(members):
     """
-    return prompt
+    Task for one call that covers several small rules. `members` is a list of
+    (rule, num_questions); every question must be tagged with its rule's questionId.
+    """
+    total = sum(num for _, num in members)
+    rule_blocks = "\n".join(
+        f"""
+        - questionId {rule['questionId']}: exactly {num} questions
+            - Question Type: {rule['questionType']}
+            - Difficulty: {rule['difficultyLevel']}
+            - Cognitive Level: {rule['cognitiveLevel']}
+            - Marks: {rule['mark']}
+            - Course Outcome: {rule.get('courseOutcome', '')}"""
+        for rule, num in members
+    )
+
+    return f"""
+    Task: Generate questions for {len(members)} separate question sets based ONLY on the provided content.
+    The `questions` argument MUST contain exactly {total} question objects in total.
 
+    1.  **Question Sets**:{rule_blocks}
 
-async def _generate_single_rule(provider_instance, prompt_text, provider_name):
-    """Makes a single async API call to the specified provider."""
-    # --- Retry logic has been removed as requested ---
+    2.  **Tagging (MANDATORY)**: In addition to the 4 keys of the Output Schema, every question object MUST
+        contain a "questionId" key whose integer value is the questionId of the set it belongs to.
+
+    3.  **Alignment**: Align each question with its own set's cognitive level and Course Outcome.
+        Questions in different sets must not repeat each other.
+
+    4.  **Answer Length**: Match each answer to its set's marks. For marks > 5, be less descriptive.
+    """
+
+
+# Schemas keep no per-call state, so each is built once and reused.
+_OUTPUT_SCHEMAS = {False: LLMToolOutputSchema(), True: LLMPackedToolOutputSchema()}
+_QUESTION_SCHEMAS = {False: LLMQuestionSchema(), True: LLMPackedQuestionSchema()}
+_QUESTION_KEYS = {
+    packed: frozenset(schema.fields) for packed, schema in _QUESTION_SCHEMAS.items()
+}
+
+
+def _well_formed_questions(args, packed):
+    """
+    The questions of a tool payload when it has exactly the shape the output
+    schema accepts unchanged (only string fields, an int questionId when
+    packed, no missing or extra keys), else None. This covers nearly every
+    answer without the cost of a full schema load; anything else is left to
+    the schema, which also produces the error messages.
+    """
+    if type(args) is not dict or len(args) != 1:
+        return None
+    items = args.get("questions")
+    if type(items) is not list:
+        return None
+    expected = _QUESTION_KEYS[packed]
+    for item in items:
+        if type(item) is not dict or item.keys() != expected:
+            return None
+        for key, value in item.items():
+            if type(value) is not (int if key == "questionId" else str):
+                return None
+    return [dict(item) for item in items]
+
+
+def _validated_question(item, packed):
+    """One question of a tool payload, validated on its own; None if it is malformed."""
+    expected = _QUESTION_KEYS[packed]
+    if type(item) is dict and item.keys() == expected and all(
+        type(value) is (int if key == "questionId" else str) for key, value in item.items()
+    ):
+        return dict(item)
+    try:
+        return _QUESTION_SCHEMAS[packed].load(item)
+    except (ValidationError, TypeError):
+        return None
+
+
+def _salvage_questions(args, provider_name, packed=False):
+    """
+    Validates tool-call arguments, keeping every valid question even when
+    others in the same payload are malformed. `packed` selects the schema of
+    the questionId-tagged tool.
+    Returns (valid_questions, received_count, salvaged_count).
+    """
+    questions = _well_formed_questions(args, packed)
+    if questions is not None:
+        return questions, len(questions), 0
+
+    output_schema = _OUTPUT_SCHEMAS[packed]
+    try:
+        validated = output_schema.load(args)
+        return validated["questions"], len(validated["questions"]), 0
+    except ValidationError as e:
+        metrics.validation_failures.inc(provider=provider_name, kind="schema")
+        error_logger.warning(
+            f"{provider_name} tool output failed schema validation: {e.messages}"
+        )
+
+    items = args.get("questions") if hasattr(args, "get") else None
+    if isinstance(items, (str, bytes)) or not hasattr(items, "__iter__"):
+        return [], 0, 0
+
+    items = list(items)
+    question_schema = _QUESTION_SCHEMAS[packed]
+    valid = []
+    for item in items:
+        try:
+            valid.append(question_schema.load(item))
+        except (ValidationError, TypeError):
+            continue
+    return valid, len(items), len(valid)
+
+
+def _record_usage(provider_name, response):
+    """Counts the token usage an upstream response reports, when it reports any."""
     if provider_name == 'gemini':
-        response = await provider_instance.generate_content_async(prompt_text)
+        usage = getattr(response, 'usage_metadata', None)
+        counts = {
+            "prompt": getattr(usage, 'prompt_token_count', 0),
+            "completion": getattr(usage, 'candidates_token_count', 0),
+            "cached": getattr(usage, 'cached_content_token_count', 0),
+        }
+    else:
+        usage = getattr(response, 'usage', None)
+        counts = {
+            "prompt": getattr(usage, 'prompt_tokens', 0),
+            "completion": getattr(usage, 'completion_tokens', 0),
+            "cached": getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', 0),
+        }
+    for kind, count in counts.items():
+        if isinstance(count, int) and count:
+            metrics.upstream_tokens.inc(count, provider=provider_name, kind=kind)
+
+
+def _empty_attempt():
+    return {"questions": [], "received": 0, "salvaged": 0}
+
+
+async def _generate_single_rule(provider_instance, prompt, provider_name, prefix_cached=False, packed=False,
+                                stream=False, stream_deadline=None):
+    """
+    Makes a single async API call to the specified provider. `prompt` is a
+    PromptParts; when `prefix_cached` is set the provider already holds the
+    prefix in its context cache and only the rule-specific suffix is sent.
+    `packed` calls use the questionId-tagged tool and cover several rules.
+    `stream` reads the answer incrementally; see _generate_single_rule_streamed.
+    Returns {"questions": [...], "received": int, "salvaged": int}.
+    """
+    if stream:
+        return await _generate_single_rule_streamed(
+            provider_instance, prompt, provider_name, prefix_cached, packed, stream_deadline
+        )
+    if provider_name == 'gemini':
+        contents = prompt.suffix if prefix_cached else [prompt.prefix, prompt.suffix]
+        response = await provider_instance.generate_content_async(contents)
+        _record_usage(provider_name, response)
         part = response.candidates[0].content.parts[0]
         if hasattr(part, 'function_call') and part.function_call.name == "submit_questions":
-            try:
-                validated = LLMToolOutputSchema().load(dict(part.function_call.args))
-                return validated["questions"]
-            except ValidationError as e:
-                error_logger.warning(
-                    f"Gemini tool output failed schema validation: {e.messages}"
-                )
-                return []
+            questions, received, salvaged = _salvage_questions(dict(part.function_call.args), provider_name, packed)
+            return {"questions": questions, "received": received, "salvaged": salvaged}
         else:
+            metrics.validation_failures.inc(provider=provider_name, kind="no_tool_call")
             error_logger.warning(
                 f"Gemini did not use the 'submit_questions' tool. "
                 f"Response text: {getattr(part, 'text', 'N/A')}"
             )
-            return []
+            return _empty_attempt()
 
     elif provider_name in ['deepseek', 'openai']:
         model_name = current_app.config['DEEPSEEK_MODEL_NAME'] if provider_name == 'deepseek' else current_app.config['OPENAI_MODEL_NAME']
 
+        # The shared prefix goes first, as its own message, so that the
+        # provider's automatic prompt-prefix caching can reuse it across rules.
         response = await provider_instance.chat.completions.create(
             model=model_name,
-            messages=[{"role": "user", "content": prompt_text}],
-            tools=[OPENAI_COMPATIBLE_TOOL],
+            messages=[
+                {"role": "system", "content": prompt.prefix},
+                {"role": "user", "content": prompt.suffix}
+            ],
+            tools=[OPENAI_COMPATIBLE_PACKED_TOOL if packed else OPENAI_COMPATIBLE_TOOL],
             tool_choice="auto"
         )
+        _record_usage(provider_name, response)
         tool_call = response.choices[0].message.tool_calls[0]
         if tool_call.function.name == "submit_questions":
-            args = json.loads(tool_call.function.arguments)
             try:
-                validated = LLMToolOutputSchema().load(args)
-                return validated["questions"]
-            except ValidationError as e:
+                args = fastjson.loads(tool_call.function.arguments)
+            except ValueError as e:
+                metrics.validation_failures.inc(provider=provider_name, kind="invalid_json")
                 error_logger.warning(
-                    f"{provider_name} tool output failed schema validation: {e.messages}"
+                    f"{provider_name} tool output is not valid JSON: {e}"
                 )
-                return []
-        return []
+                return _empty_attempt()
+            questions, received, salvaged = _salvage_questions(args, provider_name, packed)
+            return {"questions": questions, "received": received, "salvaged": salvaged}
+        metrics.validation_failures.inc(provider=provider_name, kind="no_tool_call")
+        return _empty_attempt()
 
     raise ServiceError(f"Unsupported model provider: {provider_name}", status_code=400)
 
 
-async def generate_questions_from_prompt_async(data):
+class _StreamedAttempt:
+    """Questions validated one by one as a streamed tool call delivers them."""
+    def __init__(self, provider_name, packed, stop_at=None):
+        self.provider_name = provider_name
+        self.packed = packed
+        self.stop_at = stop_at
+        self.parser = ArrayItemParser("questions")
+        self.started = time.monotonic()
+        self.tool_called = False
+        self.complete = False
+        self.interrupted = False
+        self.questions = []
+        self.received = 0
+        self.invalid = 0
+
+    def add(self, items):
+        for item in items:
+            self.received += 1
+            question = _validated_question(item, self.packed)
+            if question is None:
+                self.invalid += 1
+                continue
+            if not self.questions:
+                metrics.upstream_first_question.observe(
+                    time.monotonic() - self.started, provider=self.provider_name
+                )
+            self.questions.append(question)
+
+    def feed(self, text):
+        self.add(self.parser.feed(text))
+
+    def should_stop(self):
+        """True once `stop_at` (loop time) has passed and there are questions to keep."""
+        if self.stop_at is None or not self.questions:
+            return False
+        self.interrupted = asyncio.get_running_loop().time() >= self.stop_at
+        return self.interrupted
+
+    def result(self):
+        if not self.tool_called:
+            metrics.validation_failures.inc(provider=self.provider_name, kind="no_tool_call")
+            error_logger.warning(f"{self.provider_name} did not use the 'submit_questions' tool.")
+            return _empty_attempt()
+        truncated = self.interrupted or not self.complete
+        if truncated:
+            metrics.validation_failures.inc(provider=self.provider_name, kind="truncated")
+            error_logger.warning(
+                f"{self.provider_name} answer ended early; kept {len(self.questions)} finished questions."
+            )
+        if self.invalid:
+            metrics.validation_failures.inc(provider=self.provider_name, kind="schema")
+            error_logger.warning(
+                f"{self.provider_name} tool output had {self.invalid} of {self.received} malformed questions."
+            )
+        salvaged = len(self.questions) if truncated or self.invalid else 0
+        return {"questions": self.questions, "received": self.received, "salvaged": salvaged}
+
+
+async def _stream_gemini(provider_instance, prompt, prefix_cached, attempt):
+    contents = prompt.suffix if prefix_cached else [prompt.prefix, prompt.suffix]
+    response = await provider_instance.generate_content_async(contents, stream=True)
+    last_chunk = None
+    async for chunk in response:
+        last_chunk = chunk
+        for candidate in chunk.candidates:
+            for part in candidate.content.parts:
+                function_call = getattr(part, 'function_call', None)
+                if getattr(function_call, 'name', None) != "submit_questions":
+                    continue
+                # The SDK delivers a function call whole, in a single chunk.
+                attempt.tool_called = attempt.complete = True
+                items = dict(function_call.args).get("questions")
+                if isinstance(items, (str, bytes)) or not hasattr(items, "__iter__"):
+                    attempt.invalid += 1
+                    continue
+                attempt.add(dict(item) if hasattr(item, 'keys') else item for item in items)
+    if last_chunk is not None:
+        _record_usage('gemini', last_chunk)
+
+
+async def _stream_openai_compatible(provider_instance, prompt, provider_name, packed, attempt):
+    stream = await provider_instance.chat.completions.create(
+        model=_model_name_for(provider_name),
+        messages=[
+            {"role": "system", "content": prompt.prefix},
+            {"role": "user", "content": prompt.suffix}
+        ],
+        tools=[OPENAI_COMPATIBLE_PACKED_TOOL if packed else OPENAI_COMPATIBLE_TOOL],
+        tool_choice="auto",
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                _record_usage(provider_name, chunk)
+            for choice in chunk.choices:
+                # Only the first tool call is used, as with a complete answer.
+                for tool_call in choice.delta.tool_calls or ():
+                    if tool_call.index or tool_call.function is None:
+                        continue
+                    if tool_call.function.name:
+                        attempt.tool_called = tool_call.function.name == "submit_questions"
+                    if attempt.tool_called and tool_call.function.arguments:
+                        attempt.feed(tool_call.function.arguments)
+            if attempt.should_stop():
+                break
+    finally:
+        await stream.close()
+    attempt.complete = attempt.parser.complete
+
+
+async def _generate_single_rule_streamed(provider_instance, prompt, provider_name, prefix_cached, packed,
+                                         stream_deadline):
     """
-    Handles logic of calling the selected LLM provider concurrently for all rules.
+    Streaming variant of _generate_single_rule: questions are parsed out of
+    the tool call as it arrives and validated one at a time. When the stream
+    breaks off, is truncated or is still running at `stream_deadline` (loop
+    time), the questions finished so far are returned instead of nothing;
+    the call only fails if none had arrived.
     """
-    provider_name = data['model']
+    attempt = _StreamedAttempt(provider_name, packed, stream_deadline)
+    loop = asyncio.get_running_loop()
+    stop_handle = None
+    try:
+        async with asyncio.timeout(None) as timeout:
+            if stream_deadline is not None:
+                # A stream that stalls after some questions must not hold them
+                # until the rule deadline cancels everything: stop reading at
+                # `stream_deadline` when there is something to keep. Without
+                # any question yet, the call keeps waiting (should_stop then
+                # ends it as soon as the first one arrives).
+                def stop_if_ready():
+                    if attempt.questions:
+                        timeout.reschedule(loop.time())
+                stop_handle = loop.call_at(stream_deadline, stop_if_ready)
+
+            if provider_name == 'gemini':
+                await _stream_gemini(provider_instance, prompt, prefix_cached, attempt)
+            elif provider_name in ['deepseek', 'openai']:
+                await _stream_openai_compatible(provider_instance, prompt, provider_name, packed, attempt)
+            else:
+                raise ServiceError(f"Unsupported model provider: {provider_name}", status_code=400)
+    except ServiceError:
+        raise
+    except Exception as e:
+        if not attempt.questions:
+            raise
+        attempt.interrupted = True
+        reason = "reached its deadline" if isinstance(e, TimeoutError) else f"failed: {type(e).__name__}: {e}"
+        error_logger.warning(f"{provider_name} stream stopped early ({reason}).")
+    finally:
+        if stop_handle is not None:
+            stop_handle.cancel()
+    return attempt.result()
+
+
+def _model_name_for(provider_name):
+    """Returns the configured upstream model name for a provider."""
+    config_keys = {
+        'gemini': 'GEMINI_MODEL_NAME',
+        'deepseek': 'DEEPSEEK_MODEL_NAME',
+        'openai': 'OPENAI_MODEL_NAME',
+    }
+    return current_app.config[config_keys[provider_name]]
+
+
+def _generation_keys_for(prompts, provider_name, model_name):
+    """
+    Builds one cache/coalescing key per prompt. Identical prompts within the
+    same request get distinct keys so that duplicated rules still receive
+    distinct questions. The shared prefix is hashed once, not once per rule.
+    """
+    prefix_digests = {}
+    seen = {}
+    keys = []
+    for prompt in prompts:
+        if prompt.prefix not in prefix_digests:
+            prefix_digests[prompt.prefix] = hashlib.sha256(prompt.prefix.encode('utf-8')).hexdigest()
+        prompt_text = prefix_digests[prompt.prefix] + prompt.suffix
+        variant = seen.get(prompt_text, 0)
+        seen[prompt_text] = variant + 1
+        keys.append(make_cache_key(prompt_text, provider_name, model_name, variant))
+    return keys
+
+
+def _split_into_batches(num_questions, batch_size):
+    """
+    Splits a question count into near-equal batch sizes no larger than
+    `batch_size`, e.g. 40 with a batch size of 15 becomes [14, 13, 13].
+    """
+    if batch_size <= 0 or num_questions <= batch_size:
+        return [num_questions]
+    batch_count = -(-num_questions // batch_size)
+    base, extra = divmod(num_questions, batch_count)
+    return [base + 1 if i < extra else base for i in range(batch_count)]
+
+
+def _question_fingerprint(question):
+    """Normalised question text used to spot duplicates across batches."""
+    return " ".join(question.get("question", "").lower().split())
+
 
-    provider_instance = None
+def _merge_batches(batch_results, num_questions):
+    """Concatenates batch results, dropping duplicates and trimming to the requested count."""
+    merged = []
+    seen = set()
+    for questions in batch_results:
+        for q in questions:
+            fingerprint = _question_fingerprint(q)
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            merged.append(q)
+    return merged[:num_questions]
+
+
+def _provider_instance(provider_name, packed=False):
+    """Returns the pooled client used to call a provider on the running loop."""
     if provider_name == 'gemini':
-        provider_instance = genai.GenerativeModel(
-            model_name=current_app.config['GEMINI_MODEL_NAME'],
-            tools=[gemini_tool],
-            tool_config={"function_calling_config": "ANY"}
-        )
+        return async_clients.gemini_packed if packed else async_clients.gemini
     elif provider_name == 'deepseek':
-        provider_instance = async_clients.deepseek
+        return async_clients.deepseek
     elif provider_name == 'openai':
-        provider_instance = async_clients.openai
+        return async_clients.openai
+    raise ServiceError(f"Unsupported model provider: {provider_name}", status_code=400)
 
-    if provider_instance is None:
-        raise ServiceError(f"Unsupported model provider: {provider_name}", status_code=400)
 
-    tasks = [
-        _generate_single_rule(
-            provider_instance,
-            generate_prompt(data['module'], data.get('unit', ''), rule, rule.get("numberOfQuestions", 1), data['BookDetails'], data['content']),
-            provider_name
+class _GenerationRun:
+    """State shared by every upstream call made for one generation request."""
+    def __init__(self, data, provider_name, provider_instance, request_id=None):
+        self.provider_name = provider_name
+        self.provider_instance = provider_instance
+        self.model_name = _model_name_for(provider_name)
+        self.request_id = request_id or uuid.uuid4().hex
+        self.data = data
+        self.owner = data.get('requestedBy', '')
+        self.use_cache = data.get('useCache', True)
+        self.tokens_per_question = current_app.config.get("ESTIMATED_TOKENS_PER_QUESTION", 300)
+        self.shortfall_retries = current_app.config.get("LLM_SHORTFALL_RETRIES", 1)
+        self.retry_jitter = current_app.config.get("LLM_RETRY_JITTER_SECONDS", 0.5)
+        self.streaming = current_app.config.get("LLM_STREAMING", True)
+        # Loop time at which streamed calls stop and keep what they have, so a
+        # rule still finishes before its deadline; set when rules are scheduled.
+        self.stream_deadline = None
+        # Near-duplicate filtering against everything generated from this content.
+        self.dedup_key = (
+            content_key(data['content'])
+            if question_index.enabled and data.get('deduplicate', False) else None
         )
-        for rule in data['Rules']
-    ]
 
-    current_app.logger.info(f"Dispatching {len(tasks)} tasks to '{provider_name}' concurrently.")
+        # Routing policy: the requested provider first, then the fallbacks in order.
+        fallbacks = data.get('fallbackModels')
+        if fallbacks is None:
+            fallbacks = current_app.config.get("PROVIDER_FALLBACK_ORDER", [])
+        self.providers = [provider_name] + [p for p in dict.fromkeys(fallbacks) if p != provider_name]
+        self.hedge_percentile = current_app.config.get("HEDGE_LATENCY_PERCENTILE", 95)
+        self.hedge_min_samples = current_app.config.get("HEDGE_MIN_SAMPLES", 20)
+        self.hedge_default_delay = current_app.config.get("HEDGE_DEFAULT_DELAY_SECONDS", 60)
+        self._instances = {(provider_name, False): provider_instance}
+        # Shared tasks of packed calls, cancelled when the request ends.
+        self.pack_tasks = []
 
-    all_generated_questions = []
-    try:
-        async with asyncio.timeout(180):
-            results_from_api = await asyncio.gather(*tasks, return_exceptions=True)
-    except TimeoutError:
-        error_logger.error(
-            f"Timed out after 180s waiting for {provider_name} responses for all rules."
+    def out_of_time(self):
+        return self.stream_deadline is not None and asyncio.get_running_loop().time() >= self.stream_deadline
+
+    def provider_instance_for(self, provider_name, packed=False):
+        key = (provider_name, packed)
+        if key not in self._instances:
+            self._instances[key] = _provider_instance(provider_name, packed)
+        return self._instances[key]
+
+
+_ROUTING_COUNTERS = {"hedged": metrics.hedges, "hedge_won": metrics.hedge_wins, "failover": metrics.failovers}
+
+
+def _record_routing(event, provider_name):
+    _ROUTING_COUNTERS[event].inc(provider=provider_name)
+
+
+async def _call_provider(run, prompt, num_questions, packed=False):
+    """
+    Makes one upstream call once the scheduler grants a slot, failing over to
+    or hedging with the run's fallback providers when a routing policy is set.
+    """
+    tokens = estimate_tokens(prompt.prefix) + estimate_tokens(prompt.suffix) + num_questions * run.tokens_per_question
+
+    async def call(provider_name, mark_started=None):
+        instance = run.provider_instance_for(provider_name, packed)
+        prefix_cached = False
+        if provider_name == 'gemini':
+            cached_model = await async_clients.gemini_with_cached_prefix(prompt.prefix, packed)
+            if cached_model is not None:
+                instance, prefix_cached = cached_model, True
+
+        queued = time.monotonic()
+        async with scheduler.slot(provider_name, run.request_id, tokens):
+            started = time.monotonic()
+            metrics.queue_latency.observe(started - queued, provider=provider_name)
+            if mark_started is not None:
+                # The hedge delay is measured from here, like the latencies it comes from.
+                mark_started()
+            try:
+                result = await _generate_single_rule(
+                    instance, prompt, provider_name, prefix_cached, packed, run.streaming, run.stream_deadline
+                )
+            except Exception:
+                metrics.upstream_latency.observe(time.monotonic() - started, provider=provider_name, outcome="error")
+                raise
+        elapsed = time.monotonic() - started
+        latency_monitor.observe(provider_name, elapsed)
+        metrics.upstream_latency.observe(elapsed, provider=provider_name, outcome="success")
+        return result
+
+    if len(run.providers) == 1:
+        return await call(run.provider_name)
+
+    def hedge_delay(provider_name):
+        if not run.hedge_percentile:
+            return None
+        observed = latency_monitor.percentile(provider_name, run.hedge_percentile, run.hedge_min_samples)
+        return observed if observed is not None else run.hedge_default_delay
+
+    return await call_with_routing(run.providers, call, hedge_delay, _record_routing)
+
+
+async def _generate_batch(run, prompt, num_questions, make_prompt):
+    """
+    Generates one batch, keeping the valid questions of a partially malformed
+    answer and asking again, a bounded number of times, only for the missing count.
+    """
+    attempt = await _call_provider(run, prompt, num_questions)
+    stats = {
+        "requested": num_questions,
+        "received": attempt["received"],
+        "salvaged": attempt["salvaged"],
+        "retried": 0,
+        "duplicates": 0,
+    }
+    questions = await _accept_questions(run, [], attempt["questions"], num_questions, stats)
+    return await _fill_shortfall(run, questions, stats, num_questions, make_prompt)
+
+
+async def _accept_questions(run, questions, new_questions, num_questions, stats):
+    """
+    Appends `new_questions` to `questions`, up to `num_questions`. When the run
+    de-duplicates, near-duplicates of anything already generated from the same
+    content are dropped (and counted) instead, leaving a shortfall to retry.
+    """
+    if run.dedup_key is None:
+        return _merge_batches([questions, new_questions], num_questions)
+    # The index reads and writes SQLite, so it runs off the event loop.
+    admitted, duplicates = await asyncio.to_thread(
+        question_index.admit,
+        run.dedup_key, _merge_batches([new_questions], len(new_questions)), num_questions - len(questions)
+    )
+    stats["duplicates"] += duplicates
+    metrics.dedup_dropped.inc(duplicates)
+    return questions + admitted
+
+
+async def _fill_shortfall(run, questions, stats, num_questions, make_prompt):
+    """Asks again, a bounded number of times, for the questions still missing."""
+    for retry in range(run.shortfall_retries):
+        missing = num_questions - len(questions)
+        if missing <= 0 or run.out_of_time():
+            break
+        await asyncio.sleep(random.uniform(0, run.retry_jitter * 2 ** retry))
+        follow_up = await _call_provider(
+            run, make_prompt(missing, [q["question"] for q in questions]), missing
         )
-        raise ServiceError("The AI service took too long to respond.", status_code=504)
-    except (google_exceptions.GoogleAPICallError, APIError) as api_error:
-        error_logger.error(
-            f"API error during calls to {provider_name}: {api_error}", exc_info=True
+        stats["retried"] += missing
+        stats["received"] += follow_up["received"]
+        stats["salvaged"] += follow_up["salvaged"]
+        questions = await _accept_questions(run, questions, follow_up["questions"], num_questions, stats)
+
+    if len(questions) < num_questions:
+        error_logger.warning(
+            f"{run.provider_name} returned {len(questions)} of {num_questions} requested questions."
         )
-        raise ServiceError(f"An external service reported an error.", status_code=502)
-    except Exception as e:
+    return {"questions": questions, "stats": stats}
+
+
+async def _store_fresh(run, rule, key, questions, num_questions):
+    """
+    Keeps freshly generated questions in the question bank and, when the batch
+    is complete, in the response cache. A short batch is not cached, or every
+    later request for the same prompt would be served short as well.
+    """
+    if not questions:
+        return
+    # Both stores may be SQLite, so they are written off the event loop.
+    if len(questions) >= num_questions:
+        await asyncio.to_thread(response_cache.set, key, questions)
+    await asyncio.to_thread(question_bank.save, bank_scope(run.data, rule), questions, run.owner)
+
+
+async def _cache_lookup(keys):
+    """
+    Response cache hits among `keys`, looked up off the event loop (the cache
+    may be SQLite) and counted on /metrics.
+    """
+    if not response_cache.enabled or not keys:
+        return {}
+    hits = await asyncio.to_thread(response_cache.get_many, keys)
+    metrics.cache_requests.inc(len(hits), result="hit")
+    metrics.cache_requests.inc(len(keys) - len(hits), result="miss")
+    return hits
+
+
+async def _generate_single_rule_shared(run, rule, prompt, key, num_questions, make_prompt,
+                                      cache_checked=False):
+    """
+    Serves a batch from the response cache, or joins an identical generation that
+    is already in flight, and only calls the provider when neither applies.
+    Provider calls wait for a scheduler slot before going upstream.
+    `cache_checked` skips the cache lookup when dispatching already missed it.
+    """
+    if run.use_cache and not cache_checked:
+        cached = (await _cache_lookup([key])).get(key)
+        if cached is not None:
+            return {
+                "questions": cached,
+                "stats": {"requested": num_questions, "received": len(cached), "salvaged": 0,
+                          "retried": 0, "duplicates": 0},
+            }
+
+    async def generate():
+        result = await _generate_batch(run, prompt, num_questions, make_prompt)
+        await _store_fresh(run, rule, key, result["questions"], num_questions)
+        return result
+
+    return await inflight_generations.do(key, generate)
+
+
+async def _generate_rule(run, rule, batches, cache_checked=False):
+    """
+    Generates one rule from its batches concurrently and merges the results.
+    Raises the first error only when every batch failed.
+    Returns {"questions": [...], "stats": {...}} with stats summed over batches.
+    """
+    results = await asyncio.gather(
+        *(
+            _generate_single_rule_shared(run, rule, prompt, key, num, make_prompt, cache_checked)
+            for num, prompt, key, make_prompt in batches
+        ),
+        return_exceptions=True
+    )
+
+    succeeded = [r for r in results if not isinstance(r, BaseException)]
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if not succeeded:
+        raise failed[0]
+    for error in failed:
         error_logger.error(
-            f"Unexpected error during API calls to {provider_name}: {e}", exc_info=True
+            f"A batch of rule {rule['questionId']} failed with {run.provider_name}: {error}"
         )
-        raise ServiceError(f"An external service is unavailable.", status_code=503)
 
-    for i, result in enumerate(results_from_api):
-        rule = data['Rules'][i]
-        if isinstance(result, Exception):
+    num_questions = rule.get("numberOfQuestions", 1)
+    questions = _merge_batches([r["questions"] for r in succeeded], num_questions)
+    stats = {"requested": num_questions, "received": 0, "salvaged": 0, "retried": 0, "duplicates": 0}
+    for r in succeeded:
+        for field in ("received", "salvaged", "retried", "duplicates"):
+            stats[field] += r["stats"][field]
+    stats["returned"] = len(questions)
+    return {"questions": questions, "stats": stats}
+
+
+class _PackedGeneration:
+    """
+    One upstream call shared by several small rules. The call starts when the
+    first member rule asks for its result; each member then gets its own
+    questions back, and a member that came up short is topped up on its own.
+    Members are tagged by their position in the pack (not their questionId,
+    which need not be unique when the rules come from several papers).
+    """
+    def __init__(self, run, members, prefix):
+        # members: [(rule, num_questions, cache_key, make_prompt)]
+        self.run = run
+        self.members = members
+        self.prompt = PromptParts(prefix, generate_packed_rule_prompt(
+            [(dict(rule, questionId=tag), num) for tag, (rule, num, _, _) in enumerate(members)]
+        ))
+        self.key = make_cache_key(
+            "".join(key for _, _, key, _ in members), run.provider_name, run.model_name
+        )
+        self._task = None
+
+    async def result_for(self, tag):
+        if self._task is None:
+            self._task = asyncio.ensure_future(inflight_generations.do(self.key, self._generate))
+            self.run.pack_tasks.append(self._task)
+        # Shielded so that one member missing its deadline does not cancel the others.
+        return (await asyncio.shield(self._task))[tag]
+
+    async def _generate(self):
+        run = self.run
+        total = sum(num for _, num, _, _ in self.members)
+        attempt = await _call_provider(run, self.prompt, total, packed=True)
+
+        by_tag = {}
+        for q in attempt["questions"]:
+            by_tag.setdefault(q.pop("questionId"), []).append(q)
+
+        async def finish(tag, rule, num_questions, key, make_prompt):
+            tagged = by_tag.get(tag, [])
+            stats = {
+                "requested": num_questions,
+                "received": len(tagged),
+                "salvaged": len(tagged) if attempt["salvaged"] else 0,
+                "retried": 0,
+                "duplicates": 0,
+            }
+            questions = await _accept_questions(run, [], tagged, num_questions, stats)
+            result = await _fill_shortfall(run, questions, stats, num_questions, make_prompt)
+            await _store_fresh(run, rule, key, result["questions"], num_questions)
+            return result
+
+        return await asyncio.gather(*(finish(tag, *member) for tag, member in enumerate(self.members)))
+
+
+async def _cached_rule(rule, questions):
+    """A small rule answered from the response cache while planning packs."""
+    num_questions = rule.get("numberOfQuestions", 1)
+    return {
+        "questions": questions,
+        "stats": {"requested": num_questions, "received": len(questions), "salvaged": 0,
+                  "retried": 0, "duplicates": 0, "returned": len(questions)},
+    }
+
+
+async def _generate_packed_rule(pack, tag):
+    """Awaits a rule's share of a packed call. Same result shape as _generate_rule."""
+    result = await pack.result_for(tag)
+    return {"questions": result["questions"], "stats": {**result["stats"], "returned": len(result["questions"])}}
+
+
+async def _with_banked_questions(rule, from_bank, coro):
+    """
+    Completes a rule with the questions filled from the question bank followed
+    by those generated for the shortfall (`coro`, None when the bank covered
+    everything). Bank questions are still returned if the generation fails.
+    """
+    num_questions = rule.get("numberOfQuestions", 1)
+    result = {"questions": [], "stats": {"received": 0, "salvaged": 0, "retried": 0, "duplicates": 0}}
+    if coro is not None:
+        try:
+            result = await coro
+        except Exception as e:
+            if not from_bank:
+                raise
             error_logger.error(
-                f"Error processing rule {rule['questionId']} with {provider_name}: {result}"
+                f"Generating the shortfall of rule {rule['questionId']} failed; "
+                f"returning {len(from_bank)} questions from the bank: {e}"
             )
+    questions = from_bank + result["questions"]
+    return {
+        "questions": questions,
+        "stats": {**result["stats"], "requested": num_questions, "fromBank": len(from_bank),
+                  "returned": len(questions)},
+    }
+
+
+def _plan_packs(run, candidates):
+    """
+    Greedily groups small rules, in rule order, into packed calls bounded by
+    RULE_PACKING_MAX_QUESTIONS questions and RULE_PACKING_MAX_TOKENS estimated
+    rule-specific tokens (task text plus expected answers; the shared prefix is
+    sent once per call either way). `candidates` is a list of
+    (rule, num_questions, cache_key, make_prompt). Returns lists of members;
+    a single-member list means the rule is not packed.
+    """
+    max_questions = current_app.config.get("RULE_PACKING_MAX_QUESTIONS", 10)
+    max_tokens = current_app.config.get("RULE_PACKING_MAX_TOKENS", 8000)
+
+    groups = []
+    current, questions, tokens = [], 0, 0
+    for member in candidates:
+        _, num, _, make_prompt = member
+        member_tokens = estimate_tokens(make_prompt(num).suffix) + num * run.tokens_per_question
+        if current and (
+            questions + num > max_questions
+            or (max_tokens and tokens + member_tokens > max_tokens)
+        ):
+            groups.append(current)
+            current, questions, tokens = [], 0, 0
+        current.append(member)
+        questions += num
+        tokens += member_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+_GenerationPlan = namedtuple('_GenerationPlan', ['run', 'rules', 'banked', 'rule_batches'])
+
+
+async def _plan_generation(data, request_id=None):
+    """
+    Resolves the provider of one generation request, fills its rules from the
+    question bank and splits the rest into batches with their prompts and
+    cache keys. `request_id` lets several plans share one scheduler share.
+    """
+    provider_name = data['model']
+    provider_instance = _provider_instance(provider_name)
+
+    run = _GenerationRun(data, provider_name, provider_instance, request_id)
+
+    # Large rules are split into smaller batches that are generated in parallel.
+    batch_size = current_app.config.get("RULE_BATCH_SIZE", 10)
+
+    # The static part of the prompt is built once and shared by every rule.
+    # Content too large for one prompt is indexed instead, and each rule's
+    # prefix carries only the excerpts relevant to it; rules that select the
+    # same excerpts share the same prefix.
+    content_index = content_retriever.index_for(data['content'])
+    prefixes = {}
+
+    def prefix_for(rule):
+        chunk_ids = None
+        if content_index is not None:
+            chunk_ids = content_index.select(rule_query(data, rule), content_retriever.max_prompt_tokens)
+        if chunk_ids not in prefixes:
+            content = data['content'] if chunk_ids is None else content_index.excerpt(chunk_ids)
+            prefixes[chunk_ids] = generate_prompt_prefix(
+                data['module'], data.get('unit', ''), data['BookDetails'], content
+            )
+        return prefixes[chunk_ids]
+
+    def prompt_builder(rule, batch_index, batch_count, banked_questions):
+        prefix = prefix_for(rule)
+
+        def make_prompt(num, exclude_questions=()):
+            return PromptParts(prefix, generate_rule_prompt(
+                rule, num, batch_index, batch_count, [*banked_questions, *exclude_questions]
+            ))
+        return make_prompt
+
+    # With `useQuestionBank`, rules are filled from the bank first and only
+    # the shortfall is generated.
+    banked = []
+    rules = []
+    for rule in data['Rules']:
+        from_bank = []
+        if data.get('useQuestionBank'):
+            max_age_days = data.get('questionBankMaxAgeDays')
+            from_bank = await asyncio.to_thread(
+                question_bank.take, bank_scope(data, rule), rule.get("numberOfQuestions", 1), run.owner,
+                max_age=max_age_days * 86400 if max_age_days else None
+            )
+        banked.append(from_bank)
+        rules.append(dict(rule, numberOfQuestions=rule.get("numberOfQuestions", 1) - len(from_bank)))
+
+    rule_batches = []
+    for rule, from_bank in zip(rules, banked):
+        if rule["numberOfQuestions"] <= 0:
+            rule_batches.append([])
             continue
+        sizes = _split_into_batches(rule["numberOfQuestions"], batch_size)
+        banked_questions = [q["question"] for q in from_bank]
+        batches = []
+        for i, num in enumerate(sizes):
+            make_prompt = prompt_builder(rule, i, len(sizes), banked_questions)
+            batches.append((num, make_prompt(num), make_prompt))
+        rule_batches.append(batches)
 
-        for q in result:
-            final_question = {
-                "question": q.get("question", "").strip('"'),
-                "questionLatex": q.get("question_latex", "").strip('"'),
-                "answer": q.get("answer", "").strip('"'),
-                "answerLatex": q.get("answer_latex", "").strip('"'),
-                "cognitiveLevel": rule["cognitiveLevel"],
-                "difficultyLevel": rule["difficultyLevel"],
-                "mark": rule["mark"],
-                "questionType": rule["questionType"],
-                "courseOutcome": rule.get("courseOutcome", "") # <-- ADDED
-            }
-            all_generated_questions.append(final_question)
+    keys = iter(_generation_keys_for(
+        [prompt for batches in rule_batches for _, prompt, _ in batches],
+        provider_name, run.model_name
+    ))
+    rule_batches = [
+        [(num, prompt, next(keys), make_prompt) for num, prompt, make_prompt in batches]
+        for batches in rule_batches
+    ]
+
+    if content_index is not None:
+        current_app.logger.info(
+            f"Content of ~{estimate_tokens(data['content'])} tokens split into {len(content_index.chunks)} chunks; "
+            f"rules use {len(prefixes)} distinct excerpt sets of up to {content_retriever.max_prompt_tokens} tokens."
+        )
+    return _GenerationPlan(run, rules, banked, rule_batches)
+
+
+async def _dispatch(plans):
+    """
+    Builds one coroutine per rule (each covering all of that rule's batches)
+    for every plan, and returns each plan's coroutines in rule order.
+
+    Small single-batch rules that are not already cached share packed calls,
+    also across plans with the same provider settings and prompt prefix. A
+    rule whose prompt is identical to an earlier plan's rule is generated
+    once: it joins that rule's packed call, or its in-flight generation.
+    """
+    packs = {}
+    cached = {}
+    # Rules whose cache lookup already missed here, so it is not repeated
+    # (and counted twice) when they are generated on their own.
+    missed = set()
+    if current_app.config.get("RULE_PACKING", True):
+        max_questions = current_app.config.get("RULE_PACKING_MAX_QUESTIONS", 10)
+        first_with_key = {}
+        aliases = {}
+        # Only rules with the same prefix (content excerpts) and the same
+        # generation settings can share a call.
+        groups = {}
+        packable = [
+            (p, i, rule, batches[0])
+            for p, plan in enumerate(plans)
+            for i, (rule, batches) in enumerate(zip(plan.rules, plan.rule_batches))
+            if len(batches) == 1 and batches[0][0] <= max_questions
+        ]
+        # One lookup for all candidates.
+        hits = await _cache_lookup(list(dict.fromkeys(
+            batch[2] for p, _, _, batch in packable if plans[p].run.use_cache
+        )))
+        for p, i, rule, (num, prompt, key, make_prompt) in packable:
+            run = plans[p].run
+            if run.use_cache:
+                if key in hits:
+                    cached[p, i] = hits[key]
+                    continue
+                missed.add((p, i))
+            if key in first_with_key:
+                aliases[p, i] = first_with_key[key]
+            else:
+                first_with_key[key] = (p, i)
+                group_key = (
+                    prompt.prefix, run.provider_name, tuple(run.providers), run.use_cache,
+                    run.dedup_key, run.owner
+                )
+                groups.setdefault(group_key, []).append(((p, i), (rule, num, key, make_prompt)))
+
+        for (prefix, *_), candidates in groups.items():
+            index_of = {id(member): position for position, member in candidates}
+            run = plans[candidates[0][0][0]].run
+            for group in _plan_packs(run, [member for _, member in candidates]):
+                if len(group) < 2:
+                    continue
+                pack = _PackedGeneration(run, group, prefix)
+                for tag, member in enumerate(group):
+                    packs[index_of[id(member)]] = (pack, tag)
+        for position, first in aliases.items():
+            if first in packs:
+                packs[position] = packs[first]
+
+    coros_per_plan = []
+    generation_keys = set()
+    rule_total = 0
+    for p, plan in enumerate(plans):
+        coros = []
+        for i, (rule, batches) in enumerate(zip(plan.rules, plan.rule_batches)):
+            if not batches:
+                coro = None
+            elif (p, i) in cached:
+                coro = _cached_rule(rule, cached[p, i])
+            elif (p, i) in packs:
+                coro = _generate_packed_rule(*packs[p, i])
+            else:
+                coro = _generate_rule(plan.run, rule, batches, cache_checked=(p, i) in missed)
+                generation_keys.update(key for _, _, key, _ in batches)
+            coros.append(_with_banked_questions(plan.run.data['Rules'][i], plan.banked[i], coro))
+        coros_per_plan.append(coros)
+        rule_total += len(coros)
+
+    call_total = len({id(pack) for pack, _ in packs.values()}) + len(generation_keys)
+    bank_total = sum(len(from_bank) for plan in plans for from_bank in plan.banked)
+    providers = ", ".join(dict.fromkeys(plan.run.provider_name for plan in plans))
+    papers = f" of {len(plans)} papers" if len(plans) > 1 else ""
+    current_app.logger.info(
+        f"Dispatching {rule_total} rules{papers} as {call_total} calls to '{providers}' concurrently"
+        + (f" ({bank_total} questions filled from the question bank)." if bank_total else ".")
+    )
+    return coros_per_plan
+
+
+def _format_question(q, rule):
+    """Maps a validated LLM question onto the public response shape."""
+    return {
+        "question": q.get("question", "").strip('"'),
+        "questionLatex": q.get("question_latex", "").strip('"'),
+        "answer": q.get("answer", "").strip('"'),
+        "answerLatex": q.get("answer_latex", "").strip('"'),
+        "cognitiveLevel": rule["cognitiveLevel"],
+        "difficultyLevel": rule["difficultyLevel"],
+        "mark": rule["mark"],
+        "questionType": rule["questionType"],
+        "courseOutcome": rule.get("courseOutcome", "") # <-- ADDED
+    }
+
+
+def _is_provider_api_error(error):
+    """
+    True for an error reported by a provider's API. The SDKs are imported
+    lazily, and one that was never imported cannot have raised anything.
+    """
+    google_exceptions = sys.modules.get('google.api_core.exceptions')
+    openai = sys.modules.get('openai')
+    return (
+        (google_exceptions is not None and isinstance(error, google_exceptions.GoogleAPICallError))
+        or (openai is not None and isinstance(error, openai.APIError))
+    )
+
+
+def _describe_rule_error(error):
+    """Client-safe message for an exception raised while generating a rule."""
+    if isinstance(error, ServiceError):
+        return str(error)
+    if _is_provider_api_error(error):
+        return "An external service reported an error."
+    return "An external service is unavailable."
+
+
+def _rule_timeout_for(data):
+    """
+    Seconds each rule may take: the request budget (optionally shortened by the
+    request's `timeoutSeconds`), capped by RULE_TIMEOUT_SECONDS when set.
+    """
+    budget = current_app.config.get("REQUEST_TIMEOUT_SECONDS", 180)
+    if data.get('timeoutSeconds'):
+        budget = min(budget, data['timeoutSeconds'])
+    rule_timeout = current_app.config.get("RULE_TIMEOUT_SECONDS", 0)
+    return min(budget, rule_timeout) if rule_timeout else budget
+
+
+async def _run_with_deadline(coro, deadline):
+    """Awaits `coro`, cancelling it and raising TimeoutError at `deadline` (loop time)."""
+    async with asyncio.timeout_at(deadline):
+        return await coro
+
+
+async def _stream_plans(plans):
+    """
+    Generates the rules of all `plans` concurrently through one dispatcher and
+    yields (plan index, event) as each rule finishes; see stream_questions_by_rule.
+    """
+    coros_per_plan = await _dispatch(plans)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    waiting_for_first = set(range(len(plans)))
+    tasks = {}
+    for p, (plan, coros) in enumerate(zip(plans, coros_per_plan)):
+        rule_timeout = _rule_timeout_for(plan.run.data)
+        deadline = started + rule_timeout
+        if plan.run.streaming:
+            margin = current_app.config.get("LLM_STREAM_DEADLINE_MARGIN_SECONDS", 2)
+            plan.run.stream_deadline = deadline - min(margin, rule_timeout / 2)
+        for i, coro in enumerate(coros):
+            tasks[asyncio.ensure_future(_run_with_deadline(coro, deadline))] = (p, i)
+
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in sorted(done, key=tasks.get):
+                p, i = tasks[task]
+                run = plans[p].run
+                rule = run.data['Rules'][i]
+                error = task.exception()
+                elapsed = loop.time() - started
+                if p in waiting_for_first:
+                    metrics.first_result_latency.observe(elapsed, provider=run.provider_name)
+                    waiting_for_first.discard(p)
+                status = "timed_out" if isinstance(error, TimeoutError) else "failed" if error else "completed"
+                metrics.rule_latency.observe(elapsed, provider=run.provider_name, status=status)
+                if isinstance(error, TimeoutError):
+                    metrics.rule_timeouts.inc(provider=run.provider_name)
+                    error_logger.error(
+                        f"Timed out after {_rule_timeout_for(run.data)}s waiting for {run.provider_name} "
+                        f"response for rule {rule['questionId']}."
+                    )
+                    yield p, {
+                        "event": "error", "index": i, "questionId": rule['questionId'],
+                        "message": "The AI service took too long to respond.", "timed_out": True
+                    }
+                    continue
+                if error is not None:
+                    error_logger.error(
+                        f"Error processing rule {rule['questionId']} with {run.provider_name}: {error}"
+                    )
+                    yield p, {
+                        "event": "error", "index": i, "questionId": rule['questionId'],
+                        "message": _describe_rule_error(error), "timed_out": False
+                    }
+                    continue
+                result = task.result()
+                yield p, {
+                    "event": "rule", "index": i, "questionId": rule['questionId'],
+                    "generated_questions": [_format_question(q, rule) for q in result["questions"]],
+                    "stats": result["stats"]
+                }
+    finally:
+        for task in tasks:
+            task.cancel()
+        for plan in plans:
+            for task in plan.run.pack_tasks:
+                task.cancel()
+
+
+async def stream_questions_by_rule(data):
+    """
+    Generates all rules concurrently and yields one event per rule as soon as
+    it finishes, in completion order:
+
+        {"event": "rule", "index": ..., "questionId": ..., "generated_questions": [...], "stats": {...}}
+        {"event": "error", "index": ..., "questionId": ..., "message": ..., "timed_out": bool}
+
+    Each rule has its own deadline; a rule that misses it is cancelled and
+    reported as timed out without affecting the others.
+    """
+    async with aclosing(_stream_plans([await _plan_generation(data)])) as events:
+        async for _, event in events:
+            yield event
+
+
+async def stream_bulk_questions(papers):
+    """
+    Generates several papers (each a validated generation request) through
+    one dispatcher, so identical rule prompts across papers are generated
+    once and small rules of different papers can share packed calls. All
+    papers share one scheduler share, like a single request. Yields the
+    events of stream_questions_by_rule with the paper's position ("paper")
+    and "paperId" added, plus, once all rules of a paper have finished:
+
+        {"event": "paper", "paper": ..., "paperId": ..., "total_questions": ...}
+    """
+    request_id = uuid.uuid4().hex
+    plans = [await _plan_generation(data, request_id) for data in papers]
+    remaining = [len(data['Rules']) for data in papers]
+    totals = [0] * len(papers)
+
+    for p, data in enumerate(papers):
+        if not remaining[p]:
+            yield {"event": "paper", "paper": p, "paperId": data.get('paperId'), "total_questions": 0}
+
+    async with aclosing(_stream_plans(plans)) as events:
+        async for p, event in events:
+            paper_id = papers[p].get('paperId')
+            yield {**event, "paper": p, "paperId": paper_id}
+            totals[p] += len(event.get("generated_questions", ()))
+            remaining[p] -= 1
+            if not remaining[p]:
+                yield {"event": "paper", "paper": p, "paperId": paper_id, "total_questions": totals[p]}
+
+
+def _rule_stats_from_event(event, rule):
+    """Per-rule report for the buffered response."""
+    if event["event"] == "rule":
+        return {"questionId": rule['questionId'], "status": "completed", **event["stats"]}
+    return {
+        "questionId": rule['questionId'],
+        "status": "timed_out" if event.get("timed_out") else "failed",
+        "requested": rule.get("numberOfQuestions", 1),
+        "received": 0, "salvaged": 0, "retried": 0, "duplicates": 0, "fromBank": 0, "returned": 0,
+    }
+
+
+async def generate_questions_from_prompt_async(data):
+    """
+    Handles logic of calling the selected LLM provider concurrently for all rules.
+    Returns {"generated_questions": [...], "rule_stats": [...]} in rule order;
+    rules that missed their deadline are marked "timed_out" in rule_stats.
+    """
+    events_by_rule = {}
+    try:
+        async with aclosing(stream_questions_by_rule(data)) as events:
+            async for event in events:
+                events_by_rule[event["index"]] = event
+    except ServiceError:
+        raise
+    except Exception as e:
+        error_logger.error(
+            f"Unexpected error during API calls to {data['model']}: {e}", exc_info=True
+        )
+        raise ServiceError(f"An external service is unavailable.", status_code=503)
+
+    if events_by_rule and all(e.get("timed_out") for e in events_by_rule.values()):
+        raise ServiceError("The AI service took too long to respond.", status_code=504)
+
+    return _collect_rule_events(events_by_rule, data)
+
+
+def _collect_rule_events(events_by_rule, data):
+    """The buffered response of one request from its rule events, in rule order."""
+    all_generated_questions = []
+    rule_stats = []
+    for i in sorted(events_by_rule):
+        event = events_by_rule[i]
+        all_generated_questions.extend(event.get("generated_questions", []))
+        rule_stats.append(_rule_stats_from_event(event, data['Rules'][i]))
+    return {"generated_questions": all_generated_questions, "rule_stats": rule_stats}
+
+
+async def generate_bulk_questions_async(papers):
+    """
+    Generates several papers at once (see stream_bulk_questions).
+    Returns {"papers": [{"paper": ..., "paperId": ..., "generated_questions": [...],
+    "rule_stats": [...]}, ...]} in request order.
+    """
+    events_by_paper = [{} for _ in papers]
+    try:
+        async with aclosing(stream_bulk_questions(papers)) as events:
+            async for event in events:
+                if event["event"] != "paper":
+                    events_by_paper[event["paper"]][event["index"]] = event
+    except ServiceError:
+        raise
+    except Exception as e:
+        error_logger.error(f"Unexpected error during bulk generation: {e}", exc_info=True)
+        raise ServiceError(f"An external service is unavailable.", status_code=503)
+
+    rule_events = [e for events_by_rule in events_by_paper for e in events_by_rule.values()]
+    if rule_events and all(e.get("timed_out") for e in rule_events):
+        raise ServiceError("The AI service took too long to respond.", status_code=504)
 
-    return all_generated_questions
\ No newline at end of file
+    return {"papers": [
+        {"paper": p, "paperId": data.get('paperId'), **_collect_rule_events(events_by_rule, data)}
+        for p, (data, events_by_rule) in enumerate(zip(papers, events_by_paper))
+    ]}
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import concurrent.futures
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    coroutine, later callers await its result instead of starting their own.
+
+    Results are shared through `concurrent.futures.Future` so that callers
+    running on different event loops (one per request under WsgiToAsgi) can
+    still join the same flight. `on_coalesced()`, if given, is called each
+    time a caller joins a flight.
+    """
+    def __init__(self, on_coalesced=None):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.on_coalesced = on_coalesced
+
+    async def do(self, key, coro_factory):
+        while True:
+            with self._lock:
+                future = self._flights.get(key)
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self._flights[key] = future
+                    break
+            if self.on_coalesced is not None:
+                self.on_coalesced()
+
+            try:
+                # shield() keeps one cancelled follower from cancelling the flight.
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                # The leader was cancelled rather than us: start a new flight.
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        try:
+            result = await coro_factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
@@ -0,0 +1,88 @@
+import queue
+import asyncio
+import threading
+import contextvars
+
+from . import fastjson
+from .extensions import async_clients
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+SSE_MIMETYPE = "text/event-stream"
+
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def iterate_async_in_thread(app, agen_factory):
+    """
+    Runs an async generator on its own event loop in a background thread and
+    yields its items synchronously, so it can back a streaming WSGI response.
+    Closing the returned generator (e.g. on client disconnect) cancels the
+    async generator.
+    """
+    items = queue.Queue()
+    started = threading.Event()
+    state = {}
+
+    async def consume():
+        state['loop'] = asyncio.get_running_loop()
+        state['task'] = asyncio.current_task()
+        started.set()
+        agen = agen_factory()
+        try:
+            async for item in agen:
+                items.put(item)
+        finally:
+            await agen.aclose()
+            await async_clients.aclose()
+
+    def runner():
+        with app.app_context():
+            try:
+                asyncio.run(consume())
+            except asyncio.CancelledError:
+                pass
+            except BaseException as e:
+                items.put(_Failure(e))
+            finally:
+                started.set()
+                items.put(_DONE)
+
+    # Run in a copy of the caller's context so log records keep the request id.
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(runner,), name="stream-generation", daemon=True
+    )
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        started.wait()
+        loop, task = state.get('loop'), state.get('task')
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The loop closed between the check and the call.
+                pass
+
+
+def format_ndjson(event):
+    return fastjson.dumps(event) + "\n"
+
+
+def format_sse(event):
+    return f"event: {event['event']}\ndata: {fastjson.dumps(event)}\n\n"
@@ -0,0 +1,267 @@
+"""
+Mock LLM providers for offline benchmarks.
+
+`app` is an OpenAI-compatible HTTP server (POST /v1/chat/completions) that
+answers with a `submit_questions` tool call, streamed as server-sent events
+when the request asks for `stream`; point OPENAI_BASE_URL or
+DEEPSEEK_BASE_URL at it. `StubGenerativeModel` stands in for
+`genai.GenerativeModel` inside the app process (see benchmarks/serve.py).
+
+Both read the same fault profile from the environment:
+    BENCH_LATENCY_MS        median upstream latency (log-normal), default 800
+    BENCH_LATENCY_SIGMA     spread of the log-normal distribution, default 0.5
+    BENCH_MS_PER_QUESTION   extra latency per generated question, default 0
+    BENCH_ERROR_RATE        fraction of calls that fail (HTTP 500/429), default 0
+    BENCH_MALFORMED_RATE    fraction of calls with unusable tool output, default 0
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+from types import SimpleNamespace
+
+_SINGLE_RULE = re.compile(r"Generate exactly (\d+) questions")
+_PACKED_RULE = re.compile(r"questionId (\d+): exactly (\d+) questions")
+
+
+class FaultProfile:
+    """Latency and failure behaviour of a mock provider."""
+    def __init__(self):
+        self.latency_ms = float(os.getenv("BENCH_LATENCY_MS", "800"))
+        self.latency_sigma = float(os.getenv("BENCH_LATENCY_SIGMA", "0.5"))
+        self.ms_per_question = float(os.getenv("BENCH_MS_PER_QUESTION", "0"))
+        self.error_rate = float(os.getenv("BENCH_ERROR_RATE", "0"))
+        self.malformed_rate = float(os.getenv("BENCH_MALFORMED_RATE", "0"))
+
+    def latency(self, num_questions):
+        base = random.lognormvariate(0, self.latency_sigma) * self.latency_ms if self.latency_ms > 0 else 0.0
+        return (base + self.ms_per_question * num_questions) / 1000
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+    def malformed(self):
+        return random.random() < self.malformed_rate
+
+
+profile = FaultProfile()
+
+
+def _question():
+    # Random tokens keep the questions far apart for the near-duplicate filter.
+    text = f"Explain {uuid.uuid4().hex} in terms of {uuid.uuid4().hex}."
+    return {"question": text, "answer": f"Answer to {text}", "question_latex": text, "answer_latex": text}
+
+
+def fake_tool_args(prompt):
+    """`submit_questions` arguments satisfying the counts requested in `prompt`."""
+    packed = _PACKED_RULE.findall(prompt)
+    if packed:
+        questions = [
+            {**_question(), "questionId": int(question_id)}
+            for question_id, num in packed for _ in range(int(num))
+        ]
+    else:
+        match = _SINGLE_RULE.search(prompt)
+        questions = [_question() for _ in range(int(match.group(1)) if match else 1)]
+    return {"questions": questions}
+
+
+def malformed_tool_args(args):
+    """Tool output the service has to reject or salvage: missing keys on half the questions."""
+    for q in args["questions"][::2]:
+        q.pop("answer", None)
+    return args
+
+
+# OpenAI-compatible server
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _completion(model, arguments, prompt_tokens, completion_tokens):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": "submit_questions", "arguments": arguments},
+                }],
+            },
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+_STREAM_PIECE_CHARS = 48
+_STREAM_FIRST_TOKEN_SHARE = 0.2
+
+
+def _chunk(completion_id, model, delta=None, usage=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": None}],
+        "usage": usage,
+    }
+
+
+async def _send_stream(send, request, arguments, latency, usage):
+    """
+    Streams the tool call in small argument pieces: the first after a share
+    of `latency` (time to first token), the rest spread over the remainder.
+    """
+    model = request.get("model", "mock")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    pieces = [arguments[i:i + _STREAM_PIECE_CHARS] for i in range(0, len(arguments), _STREAM_PIECE_CHARS)]
+    deltas = [{"role": "assistant", "content": None, "tool_calls": [{
+        "index": 0, "id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+        "function": {"name": "submit_questions", "arguments": ""},
+    }]}]
+    deltas += [{"tool_calls": [{"index": 0, "function": {"arguments": piece}}]} for piece in pieces]
+    chunks = [_chunk(completion_id, model, delta) for delta in deltas]
+    if (request.get("stream_options") or {}).get("include_usage"):
+        chunks.append(_chunk(completion_id, model, usage=usage))
+
+    await asyncio.sleep(latency * _STREAM_FIRST_TOKEN_SHARE)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+    })
+    interval = latency * (1 - _STREAM_FIRST_TOKEN_SHARE) / max(len(pieces), 1)
+    for index, chunk in enumerate(chunks):
+        if index > 1:
+            await asyncio.sleep(interval)
+        await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+
+async def app(scope, receive, send):
+    """ASGI app serving POST /v1/chat/completions."""
+    if scope["type"] == "lifespan":
+        while (await receive())["type"] != "lifespan.shutdown":
+            await send({"type": "lifespan.startup.complete"})
+        await send({"type": "lifespan.shutdown.complete"})
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "GET" and scope["path"] == "/health":
+        await _send_json(send, 200, {"status": "healthy"})
+        return
+    if scope["method"] != "POST" or not scope["path"].endswith("/chat/completions"):
+        await _send_json(send, 404, {"error": {"message": "Not found"}})
+        return
+
+    request = json.loads(await _read_body(receive))
+    messages = request.get("messages", [])
+    prompt = messages[-1]["content"] if messages else ""
+    args = fake_tool_args(prompt)
+    latency = profile.latency(len(args["questions"]))
+
+    if profile.fails():
+        await asyncio.sleep(latency)
+        status = random.choice((429, 500))
+        await _send_json(send, status, {"error": {"message": "Injected failure", "type": "server_error"}})
+        return
+
+    arguments = json.dumps(args)
+    if profile.malformed():
+        # Either truncated JSON or questions with missing keys.
+        arguments = arguments[:len(arguments) // 2] if random.random() < 0.5 else json.dumps(malformed_tool_args(args))
+
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    completion_tokens = len(arguments) // 4
+    if request.get("stream"):
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        await _send_stream(send, request, arguments, latency, usage)
+        return
+    await asyncio.sleep(latency)
+    await _send_json(send, 200, _completion(request.get("model", "mock"), arguments, prompt_tokens, completion_tokens))
+
+
+# Gemini stub
+
+async def _single_chunk(response):
+    # The SDK streams a function call whole, so it arrives in one chunk.
+    yield response
+
+
+class StubGenerativeModel:
+    """Drop-in for `genai.GenerativeModel` answering with the same fault profile."""
+    def __init__(self, model_name="mock-gemini", tools=None, tool_config=None, **kwargs):
+        self.model_name = model_name
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(model_name=getattr(cached_content, "model", "mock-gemini"))
+
+    async def generate_content_async(self, contents, **kwargs):
+        # Imported here so the HTTP mock does not need the Google SDK.
+        from google.api_core import exceptions as google_exceptions
+
+        prompt = contents if isinstance(contents, str) else contents[-1]
+        args = fake_tool_args(prompt)
+        await asyncio.sleep(profile.latency(len(args["questions"])))
+
+        if profile.fails():
+            raise random.choice((google_exceptions.ServiceUnavailable, google_exceptions.ResourceExhausted))(
+                "Injected failure"
+            )
+
+        if profile.malformed():
+            if random.random() < 0.5:
+                part = SimpleNamespace(text="I cannot call tools right now.")
+            else:
+                part = SimpleNamespace(function_call=SimpleNamespace(
+                    name="submit_questions", args=malformed_tool_args(args)
+                ))
+        else:
+            part = SimpleNamespace(function_call=SimpleNamespace(name="submit_questions", args=args))
+
+        prompt_text = contents if isinstance(contents, str) else "".join(contents)
+        response = SimpleNamespace(
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt_text) // 4,
+                candidates_token_count=len(json.dumps(args)) // 4,
+                cached_content_token_count=0,
+            ),
+        )
+        return _single_chunk(response) if kwargs.get("stream") else response
@@ -0,0 +1,292 @@
+"""
+Offline load test: starts the mock OpenAI-compatible server and the service
+(with the Gemini stub), drives /generate_questions and reports throughput,
+latency percentiles and server memory.
+
+    python -m benchmarks.run --provider openai --requests 200 --concurrency 20 --rules 8
+
+Nothing leaves the machine; all API keys are dummies.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from contextlib import contextmanager
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_USERNAME = "bench-admin"
+_PASSWORD = "bench-password-000000000000"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of /generate_questions against mock LLMs.")
+    parser.add_argument("--provider", choices=("openai", "deepseek", "gemini"), default="openai")
+    parser.add_argument("--requests", type=int, default=100, help="Total generation requests to send.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once.")
+    parser.add_argument("--rules", type=int, default=5, help="Rules per request.")
+    parser.add_argument("--questions", type=int, default=2, help="numberOfQuestions per rule.")
+    parser.add_argument("--stream", choices=("ndjson", "sse"), help="Use a streaming response format.")
+    parser.add_argument("--use-cache", action="store_true", help="Send identical requests with useCache on.")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the service.")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Median mock upstream latency.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of the latency.")
+    parser.add_argument("--ms-per-question", type=float, default=0, help="Extra mock latency per question.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls that fail.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of unusable tool outputs.")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request in seconds.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the service, e.g. --env RULE_PACKING=false.")
+    parser.add_argument("--json", dest="json_output", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _fault_env(args):
+    return {
+        "BENCH_LATENCY_MS": str(args.latency_ms),
+        "BENCH_LATENCY_SIGMA": str(args.latency_sigma),
+        "BENCH_MS_PER_QUESTION": str(args.ms_per_question),
+        "BENCH_ERROR_RATE": str(args.error_rate),
+        "BENCH_MALFORMED_RATE": str(args.malformed_rate),
+    }
+
+
+@contextmanager
+def _process(command, env, cwd, log_path):
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen(command, env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            yield proc
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def _wait_healthy(url, proc, log_path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"{url} exited during startup:\n{f.read()[-2000:]}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+def _rss_bytes(pid):
+    """Resident memory of `pid` and all its descendants (Linux /proc only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+async def _sample_memory(pid, samples, interval=0.25):
+    while True:
+        samples.append(_rss_bytes(pid))
+        await asyncio.sleep(interval)
+
+
+def _payload(args, index):
+    # Distinct content per request unless the cache is being exercised.
+    content = "Linear algebra: vectors, matrices and eigenvalues."
+    if not args.use_cache:
+        content = f"{content} (benchmark request {index})"
+    return {
+        "module": "Benchmark",
+        "unit": "1",
+        "content": content,
+        "BookDetails": [{"BookName": "Benchmark Book", "BookType": "Textbook"}],
+        "model": args.provider,
+        "useCache": args.use_cache,
+        "Rules": [
+            {
+                "questionId": i,
+                "questionType": "Short Answer",
+                "difficultyLevel": "Medium",
+                "cognitiveLevel": "Understanding",
+                "mark": 2,
+                "numberOfQuestions": args.questions,
+                "courseOutcome": "CO1",
+            }
+            for i in range(args.rules)
+        ],
+    }
+
+
+def _count_questions(body, stream_format):
+    if not stream_format:
+        return len(body.get("generated_questions", []))
+    for line in body.splitlines():
+        line = line.removeprefix("data:").strip()
+        if line.startswith("{"):
+            event = json.loads(line)
+            if event.get("event") == "done":
+                return event["total_questions"]
+    return 0
+
+
+async def _one_request(client, args, index, headers, results):
+    query = f"?stream={args.stream}" if args.stream else ""
+    started = time.perf_counter()
+    try:
+        response = await client.post(f"/generate_questions{query}", json=_payload(args, index), headers=headers)
+        elapsed = time.perf_counter() - started
+        questions = 0
+        if response.status_code < 400:
+            questions = _count_questions(response.text if args.stream else response.json(), args.stream)
+        results.append((response.status_code, elapsed, questions))
+    except httpx.HTTPError as e:
+        results.append((type(e).__name__, time.perf_counter() - started, 0))
+
+
+async def drive(base_url, pid, args):
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        login = await client.post("/login", json={"username": _USERNAME, "password": _PASSWORD})
+        login.raise_for_status()
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        results = []
+        memory = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                await _one_request(client, args, index, headers, results)
+
+        sampler = asyncio.ensure_future(_sample_memory(pid, memory))
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(limited(i) for i in range(args.requests)))
+        finally:
+            wall = time.perf_counter() - started
+            sampler.cancel()
+        memory.append(_rss_bytes(pid))
+    return results, memory, wall
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def build_report(args, results, memory, wall):
+    latencies = sorted(elapsed for _, elapsed, _ in results)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    succeeded = sum(1 for status, _, _ in results if isinstance(status, int) and status < 400)
+    questions = sum(q for _, _, q in results)
+    return {
+        "provider": args.provider,
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "rules_per_request": args.rules,
+        "workers": args.workers,
+        "statuses": statuses,
+        "success_rate": succeeded / len(results) if results else 0.0,
+        "wall_seconds": wall,
+        "requests_per_second": len(results) / wall if wall else 0.0,
+        "questions_per_second": questions / wall if wall else 0.0,
+        "latency_seconds": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "server_rss_mb": {
+            "peak": max(memory) / 2 ** 20 if memory else 0.0,
+            "final": memory[-1] / 2 ** 20 if memory else 0.0,
+        },
+    }
+
+
+def print_report(report):
+    latency = report["latency_seconds"]
+    rss = report["server_rss_mb"]
+    print(f"provider={report['provider']} workers={report['workers']} concurrency={report['concurrency']} "
+          f"rules/request={report['rules_per_request']}")
+    print(f"requests:   {report['requests']} in {report['wall_seconds']:.2f}s "
+          f"({report['requests_per_second']:.2f} req/s, {report['questions_per_second']:.1f} questions/s)")
+    print(f"statuses:   {report['statuses']} (success {report['success_rate']:.1%})")
+    print(f"latency:    mean {latency['mean']:.3f}s  p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+          f"p99 {latency['p99']:.3f}s  max {latency['max']:.3f}s")
+    print(f"server RSS: peak {rss['peak']:.1f} MB  final {rss['final']:.1f} MB")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock_port, app_port = _free_port(), _free_port()
+
+    with tempfile.TemporaryDirectory(prefix="qb-bench-") as workdir:
+        env = {
+            **os.environ,
+            **_fault_env(args),
+            "PYTHONPATH": os.pathsep.join(filter(None, (REPO_ROOT, os.environ.get("PYTHONPATH")))),
+            "JWT_SECRET_KEY": "bench-jwt-secret-0000000000000000000000",
+            "ADMIN_USERNAME": _USERNAME,
+            "ADMIN_PASSWORD": _PASSWORD,
+            "GOOGLE_API_KEY": "bench",
+            "OPENAI_API_KEY": "bench",
+            "DEEPSEEK_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+            "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+            "GEMINI_CONTEXT_CACHE_MIN_TOKENS": "0",
+            "LOG_LEVEL_APP": "WARNING",
+            "LOG_LEVEL_ACCESS": "WARNING",
+        }
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+        mock_log = os.path.join(workdir, "mock.log")
+        app_log = os.path.join(workdir, "app.log")
+        with _process([*uvicorn, "--port", str(mock_port), "benchmarks.mock_llm:app"], env, workdir, mock_log) as mock, \
+                _process([*uvicorn, "--port", str(app_port), "--workers", str(args.workers), "benchmarks.serve:app"],
+                         env, workdir, app_log) as server:
+            _wait_healthy(f"http://127.0.0.1:{mock_port}/health", mock, mock_log)
+            _wait_healthy(f"http://127.0.0.1:{app_port}/health", server, app_log)
+            results, memory, wall = asyncio.run(drive(f"http://127.0.0.1:{app_port}", server.pid, args))
+
+    report = build_report(args, results, memory, wall)
+    if args.json_output:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0 if report["success_rate"] > 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
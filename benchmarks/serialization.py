@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of request validation, tool-output parsing and response
+encoding, comparing the previous per-call schema / stdlib json path with
+the current one:
+
+    python -m benchmarks.serialization --rules 50 --questions 40
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+
+# Importing the app package reads the configuration; these are never used.
+for _name in ("JWT_SECRET_KEY", "ADMIN_USERNAME", "ADMIN_PASSWORD",
+              "GOOGLE_API_KEY", "DEEPSEEK_API_KEY", "OPENAI_API_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from app import fastjson  # noqa: E402
+from app.schemas import GenerateSchema, LLMToolOutputSchema, load_generate_request  # noqa: E402
+from app.services import _salvage_questions  # noqa: E402
+
+
+def _request_body(rules):
+    return {
+        "module": "Linear Algebra",
+        "unit": "2",
+        "content": "Vectors, matrices, determinants and eigenvalues. " * 200,
+        "BookDetails": [{"BookName": "Linear Algebra Done Right", "BookType": "Textbook"}],
+        "model": "openai",
+        "Rules": [
+            {
+                "questionId": i,
+                "questionType": "Short Answer",
+                "difficultyLevel": "Medium",
+                "cognitiveLevel": "Understanding",
+                "mark": 2,
+                "numberOfQuestions": 3,
+                "courseOutcome": f"CO{i % 5}",
+            }
+            for i in range(rules)
+        ],
+    }
+
+
+def _question(i):
+    text = f"Explain why the eigenvalues of the symmetric matrix number {i} are real. சமச்சீர் அணி"
+    return {"question": text, "answer": f"Because ... ({i})", "question_latex": text, "answer_latex": f"A_{{{i}}}"}
+
+
+def _response(questions):
+    return {
+        "generated_questions": [
+            {**_question(i), "cognitiveLevel": "Understanding", "difficultyLevel": "Medium", "mark": 2,
+             "questionType": "Short Answer", "courseOutcome": "CO1"}
+            for i in range(questions)
+        ],
+        "rule_stats": [{"questionId": i, "requested": 3, "returned": 3, "status": "ok"} for i in range(questions // 3)],
+    }
+
+
+def _per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(rules, questions, number):
+    body = _request_body(rules)
+    body_text = json.dumps(body)
+    tool_args = {"questions": [_question(i) for i in range(questions)]}
+    tool_text = json.dumps(tool_args)
+    response = _response(questions)
+
+    flask_app = Flask(__name__)
+    default_provider = DefaultJSONProvider(flask_app)
+    fast_provider = fastjson.FastJSONProvider(flask_app)
+
+    cases = [
+        ("request: parse + validate",
+         lambda: GenerateSchema().load(json.loads(body_text)),
+         lambda: load_generate_request(fastjson.loads(body_text))),
+        ("tool output: parse + validate",
+         lambda: LLMToolOutputSchema().load(json.loads(tool_text)),
+         lambda: _salvage_questions(fastjson.loads(tool_text), "openai")),
+        ("response: encode",
+         lambda: default_provider.response(response).get_data(),
+         lambda: fast_provider.response(response).get_data()),
+        ("stream event: encode",
+         lambda: json.dumps(response["generated_questions"][:3]),
+         lambda: fastjson.dumps(response["generated_questions"][:3])),
+    ]
+
+    print(f"rules={rules} questions={questions} orjson={'yes' if fastjson.orjson else 'no'}")
+    print(f"{'case':32} {'before':>12} {'after':>12} {'speed-up':>9}")
+    with flask_app.app_context():
+        for name, before, after in cases:
+            before_s = _per_call(before, number)
+            after_s = _per_call(after, number)
+            print(f"{name:32} {before_s * 1e6:10.1f}us {after_s * 1e6:10.1f}us {before_s / after_s:8.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validation and JSON encoding micro-benchmark.")
+    parser.add_argument("--rules", type=int, default=50, help="Rules in the request body.")
+    parser.add_argument("--questions", type=int, default=40, help="Questions in the tool output and response.")
+    parser.add_argument("--number", type=int, default=200, help="Calls per timing run.")
+    args = parser.parse_args(argv)
+    run(args.rules, args.questions, args.number)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""
+The service's ASGI app with Gemini replaced by the stub from mock_llm:
+
+    uvicorn benchmarks.serve:app --workers 4
+
+OpenAI and DeepSeek are redirected with OPENAI_BASE_URL / DEEPSEEK_BASE_URL.
+"""
+import google.generativeai as genai
+
+from benchmarks.mock_llm import StubGenerativeModel
+
+genai.GenerativeModel = StubGenerativeModel
+
+from run import app  # noqa: E402
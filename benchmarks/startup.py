@@ -0,0 +1,96 @@
+"""
+Cold-start benchmark of `run.py`: time to import it (which builds the app)
+and the resident memory afterwards, each measured in a fresh interpreter.
+
+    python -m benchmarks.startup --samples 10
+
+"lazy" is the default start-up, with provider SDKs imported on first use;
+"eager" also imports and configures every provider SDK, as every worker
+did at start-up before.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import run
+if sys.argv[1] == "eager":
+    from app.extensions import async_clients
+    async_clients.warm_up(["gemini", "openai"])
+elapsed = time.perf_counter() - started
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * resource.getpagesize()
+print(json.dumps({"seconds": elapsed, "rss": rss}))
+"""
+
+MODES = ("lazy", "eager")
+
+
+def _sample(mode, workdir, env):
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE, mode], cwd=workdir, env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(samples):
+    results = {mode: [] for mode in MODES}
+    with tempfile.TemporaryDirectory(prefix="qb-startup-") as workdir:
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(filter(None, (REPO_ROOT, os.environ.get("PYTHONPATH")))),
+            "JWT_SECRET_KEY": "bench-jwt-secret-0000000000000000000000",
+            "ADMIN_USERNAME": "bench-admin",
+            "ADMIN_PASSWORD": "bench-password-000000000000",
+            "GOOGLE_API_KEY": "bench",
+            "OPENAI_API_KEY": "bench",
+            "DEEPSEEK_API_KEY": "bench",
+            "LLM_WARMUP_PROVIDERS": "",
+            "LOG_LEVEL_APP": "WARNING",
+        }
+        _sample("lazy", workdir, env)  # warms the filesystem and bytecode caches
+        # Interleaved so that background noise affects both modes alike.
+        for _ in range(samples):
+            for mode in MODES:
+                results[mode].append(_sample(mode, workdir, env))
+
+    return {
+        mode: {
+            "seconds_median": statistics.median(s["seconds"] for s in runs),
+            "seconds_min": min(s["seconds"] for s in runs),
+            "rss_mb_median": statistics.median(s["rss"] for s in runs) / 2 ** 20,
+        }
+        for mode, runs in results.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start-up time and memory of run.py, lazy vs eager SDK loading.")
+    parser.add_argument("--samples", type=int, default=5, help="Fresh interpreters per mode.")
+    parser.add_argument("--json", dest="json_output", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args(argv)
+
+    report = run(args.samples)
+    if args.json_output:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{'mode':8} {'median':>10} {'min':>10} {'RSS':>10}")
+    for mode, row in report.items():
+        print(f"{mode:8} {row['seconds_median']:9.3f}s {row['seconds_min']:9.3f}s {row['rss_mb_median']:7.1f} MB")
+    lazy, eager = report["lazy"], report["eager"]
+    print(f"lazy start-up saves {eager['seconds_median'] - lazy['seconds_median']:.3f}s and "
+          f"{eager['rss_mb_median'] - lazy['rss_mb_median']:.1f} MB per worker")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,13 @@
 
 from asgiref.wsgi import WsgiToAsgi
 from app import create_app
+from app.asgi import create_asgi_app
 
 flask_app = create_app()
 
-app = WsgiToAsgi(flask_app)
\ No newline at end of file
+# "asgi" serves the generation endpoints natively on uvicorn's event loop;
+# "wsgi" runs the whole Flask app through WsgiToAsgi as before.
+if flask_app.config["SERVER_MODE"] == "wsgi":
+    app = WsgiToAsgi(flask_app)
+else:
+    app = create_asgi_app(flask_app)
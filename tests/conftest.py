@@ -0,0 +1,6 @@
+import os
+
+# app.config refuses to load without these; the tests never reach a provider.
+for name in ("JWT_SECRET_KEY", "ADMIN_USERNAME", "ADMIN_PASSWORD",
+             "GOOGLE_API_KEY", "DEEPSEEK_API_KEY", "OPENAI_API_KEY"):
+    os.environ.setdefault(name, "test")
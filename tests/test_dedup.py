@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.dedup import QuestionIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    question_index = QuestionIndex()
+    question_index.init_app(SimpleNamespace(config={
+        "DEDUP_ENABLED": True,
+        "DEDUP_INDEX_PATH": str(tmp_path / "question_index.sqlite3"),
+    }))
+    return question_index
+
+
+def _questions(*texts):
+    return [{"question": text} for text in texts]
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Find the determinant of the matrix [[2, 3], [1, 4]].",
+     "Find the determinant of the matrix [[5, 1], [2, 7]]."),
+    ("Find the eigenvalues of the matrix A = [[2, 1], [1, 2]].",
+     "Find the eigenvalues of the matrix A = [[4, 1], [2, 3]]."),
+    ("A train travels 120 km in 2 hours. What is its average speed?",
+     "A train travels 150 km in 3 hours. What is its average speed?"),
+])
+def test_questions_differing_only_in_numbers_are_both_admitted(index, first, second):
+    admitted, duplicates = index.admit("content", _questions(first), 1)
+    assert len(admitted) == 1 and duplicates == 0
+
+    admitted, duplicates = index.admit("content", _questions(second), 1)
+    assert [q["question"] for q in admitted] == [second]
+    assert duplicates == 0
+
+
+def test_repeated_question_is_dropped(index):
+    index.admit("content", _questions("Find the determinant of the matrix [[2, 3], [1, 4]]."), 1)
+
+    admitted, duplicates = index.admit(
+        "content", _questions("find the determinant of the  matrix [[2,3],[1,4]]"), 1
+    )
+    assert admitted == []
+    assert duplicates == 1
+
+
+def test_indexes_are_kept_per_content(index):
+    question = "Explain the significance of the Cayley-Hamilton theorem."
+    index.admit("first", _questions(question), 1)
+
+    admitted, duplicates = index.admit("second", _questions(question), 1)
+    assert len(admitted) == 1 and duplicates == 0
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.jobs import JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    job_store = JobStore()
+    job_store.init_app(SimpleNamespace(config={
+        "JOB_STORE_PATH": str(tmp_path / "jobs.sqlite3"),
+        "JOB_STALE_SECONDS": 60,
+    }))
+    return job_store
+
+
+def _age(store, job_id, seconds):
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET updated_at = updated_at - ? WHERE id = ?", (seconds, job_id))
+
+
+@pytest.mark.parametrize("status", [JOB_QUEUED, JOB_RUNNING])
+def test_unfinished_job_without_heartbeat_is_failed(store, status):
+    job_id = store.create("owner", 1)
+    store.set_status(job_id, status)
+    _age(store, job_id, 120)
+
+    job = store.get(job_id)
+    assert job["status"] == JOB_FAILED
+    assert job["error"]
+
+
+def test_heartbeat_keeps_queued_job_alive(store):
+    job_id = store.create("owner", 1)
+    _age(store, job_id, 120)
+    store.touch([job_id])
+
+    assert store.get(job_id)["status"] == JOB_QUEUED
+
+
+def test_finished_job_keeps_its_status(store):
+    job_id = store.create("owner", 1)
+    store.set_status(job_id, JOB_COMPLETED)
+    _age(store, job_id, 120)
+
+    assert store.set_status(job_id, JOB_RUNNING) is False
+    assert store.get(job_id)["status"] == JOB_COMPLETED
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from app.jsonstream import ArrayItemParser
+
+
+QUESTIONS = [
+    {"question": 'What does "det" stand for?', "answer": "Determinant"},
+    {"question": "Simplify {a} \\cup [b]", "answer": "\\{a, b\\}"},
+    {"question": "Évaluer ∫ x dx \U0001F600", "answer": "x²/2 + C"},
+]
+DOCUMENT = json.dumps({"questions": QUESTIONS})  # ensure_ascii: unicode arrives as \u escapes
+RAW_DOCUMENT = json.dumps({"questions": QUESTIONS}, ensure_ascii=False, indent=2)
+
+
+def _feed(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def test_whole_document():
+    parser = ArrayItemParser()
+    assert parser.feed(DOCUMENT) == QUESTIONS
+    assert parser.complete
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_chunks_split_anywhere(size):
+    # Splits fall inside keys, escapes (\", \\, \uXXXX) and between tokens.
+    parser = ArrayItemParser()
+    chunks = [DOCUMENT[i:i + size] for i in range(0, len(DOCUMENT), size)]
+    assert _feed(parser, chunks) == QUESTIONS
+    assert parser.complete
+
+
+@pytest.mark.parametrize("document", [DOCUMENT, RAW_DOCUMENT])
+def test_every_split_point(document):
+    for cut in range(1, len(document)):
+        parser = ArrayItemParser()
+        assert _feed(parser, [document[:cut], document[cut:]]) == QUESTIONS, cut
+
+
+def test_items_are_returned_as_they_complete():
+    parser = ArrayItemParser()
+    first_end = DOCUMENT.index("}") + 1
+    assert parser.feed(DOCUMENT[:first_end - 1]) == []
+    assert parser.feed(DOCUMENT[first_end - 1:first_end]) == QUESTIONS[:1]
+
+
+def test_truncated_mid_object_keeps_finished_items():
+    parser = ArrayItemParser()
+    cut = DOCUMENT.index("Simplify")
+    assert _feed(parser, [DOCUMENT[:cut]]) == QUESTIONS[:1]
+    assert not parser.complete
+
+
+def test_other_keys_and_non_objects_are_skipped():
+    document = json.dumps({
+        "note": {"questions": [{"question": "nested, not ours"}]},
+        "questions": [1, "two", {"question": "kept"}],
+    })
+    parser = ArrayItemParser()
+    assert parser.feed(document) == [{"question": "kept"}]
+    assert parser.complete
+
+
+def test_malformed_item_is_returned_as_none():
+    parser = ArrayItemParser()
+    items = parser.feed('{"questions": [{"question": "a",}, {"question": "b"}]}')
+    assert items == [None, {"question": "b"}]
+
+
+def test_text_after_completion_is_ignored():
+    parser = ArrayItemParser()
+    parser.feed(DOCUMENT)
+    assert parser.feed('{"questions": [{"question": "late"}]}') == []
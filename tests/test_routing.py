@@ -0,0 +1,40 @@
+import asyncio
+from collections import Counter
+
+from app.routing import call_with_routing
+
+
+def _route(queue_seconds, upstream_seconds, hedge_after):
+    calls = []
+
+    async def call(provider_name, mark_started):
+        calls.append(provider_name)
+        if provider_name == "primary":
+            await asyncio.sleep(queue_seconds)
+            mark_started()
+            await asyncio.sleep(upstream_seconds)
+        else:
+            mark_started()
+            await asyncio.sleep(upstream_seconds)
+        return provider_name
+
+    events = Counter()
+    result = asyncio.run(call_with_routing(
+        ["primary", "fallback"], call, lambda provider_name: hedge_after,
+        lambda event, provider_name: events.update([event])
+    ))
+    return result, calls, events
+
+
+def test_queue_time_does_not_count_toward_the_hedge_delay():
+    result, calls, events = _route(queue_seconds=0.2, upstream_seconds=0.05, hedge_after=0.1)
+    assert result == "primary"
+    assert calls == ["primary"]
+    assert not events
+
+
+def test_slow_upstream_call_is_hedged():
+    result, calls, events = _route(queue_seconds=0, upstream_seconds=0.3, hedge_after=0.05)
+    assert calls == ["primary", "fallback"]
+    assert events == {"hedged": 1}
+    assert result == "primary"